@@ -0,0 +1,33 @@
+# ai_cache.py
+import hashlib
+import json
+
+from cachetools import TTLCache
+
+# Drafted completions keyed by the exact prompt. Only touched from the event
+# loop, so no lock is needed. Matching is exact rather than by embedding
+# similarity: prompts are personalised per lead, so a merely similar prompt
+# would reuse a draft addressed to someone else.
+_drafts = TTLCache(maxsize=5_000, ttl=3600)
+
+
+def draft_cache_key(key_prefix, messages):
+    payload = json.dumps(messages, sort_keys=True, separators=(",", ":"))
+    return f"{key_prefix}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+async def get_or_draft(key_prefix, messages, draft):
+    """
+    Return the cached completion for these exact messages, or await draft()
+    and cache its result.
+
+    key_prefix scopes entries (e.g. template name and user id); draft is a
+    zero-argument callable returning an awaitable of the completion text.
+    """
+    key = draft_cache_key(key_prefix, messages)
+    cached = _drafts.get(key)
+    if cached is not None:
+        return cached
+    result = await draft()
+    _drafts[key] = result
+    return result
@@ -1,14 +1,29 @@
-# database.py
-from sqlalchemy import create_engine
+import orjson
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import DATABASE_URL
 
-# Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+
+def _json_serializer(value):
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+# Create SQLAlchemy engine once per process; sessions check connections out of
+# this pool instead of opening a new one per request.
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=20,
+    max_overflow=30,
+    pool_pre_ping=True,
+    pool_use_lifo=True,
+    pool_recycle=1800,
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads
+)
 
 # Create SessionLocal class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
 
 # Create Base class for declarative models
 Base = declarative_base()
@@ -23,6 +38,76 @@ def get_db():
         db.close()
 
 
+# Idempotent DDL for databases created before a model change; create_all()
+# only creates tables that do not exist yet.
+SCHEMA_UPGRADES = [
+    # The old select-then-insert saves could race into duplicate rows, which
+    # would fail the unique indexes; keep only the newest row of each pair.
+    "DELETE FROM integrations dup USING integrations keep "
+    "WHERE dup.user_id = keep.user_id AND dup.platform_name = keep.platform_name AND dup.id < keep.id",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_integration_user_platform "
+    "ON integrations (user_id, platform_name)",
+    "DELETE FROM integration_status dup USING integration_status keep "
+    "WHERE dup.user_id = keep.user_id AND dup.platform_name = keep.platform_name AND dup.id < keep.id",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_integration_status_user_platform "
+    "ON integration_status (user_id, platform_name)",
+    "CREATE INDEX IF NOT EXISTS ix_lead_name_trgm ON leads USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_lead_user_created ON leads (user_id, created_at DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_appointment_user_time ON appointments (user_id, appointment_time)",
+    "CREATE INDEX IF NOT EXISTS ix_call_user_created ON calls (user_id, created_at DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_dlc_user_created ON drew_lead_communications (user_id, created_at DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_ulc_user_created ON user_lead_communications (user_id, created_at DESC)",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS use_ai_drafting BOOLEAN NOT NULL DEFAULT false",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS first_name VARCHAR "
+    "GENERATED ALWAYS AS (split_part(btrim(name), ' ', 1)) STORED",
+    "ALTER TABLE leads ADD COLUMN IF NOT EXISTS first_name VARCHAR "
+    "GENERATED ALWAYS AS (split_part(btrim(name), ' ', 1)) STORED",
+    "ALTER TABLE integrations ADD COLUMN IF NOT EXISTS token VARCHAR",
+    "ALTER TABLE integrations ADD COLUMN IF NOT EXISTS token_expiry TIMESTAMP WITHOUT TIME ZONE",
+    # Convert the models' remaining json columns to jsonb.
+    """
+    DO $$
+    DECLARE col record;
+    BEGIN
+        FOR col IN
+            SELECT table_name, column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND data_type = 'json'
+              AND table_name IN (
+                  'users', 'leads', 'integrations', 'onboarding', 'appointments',
+                  'drew_lead_communications', 'user_lead_communications', 'user_drew_communications'
+              )
+        LOOP
+            EXECUTE format(
+                'ALTER TABLE %I ALTER COLUMN %I TYPE jsonb USING %I::jsonb',
+                col.table_name, col.column_name, col.column_name
+            );
+        END LOOP;
+    END $$
+    """,
+] + [
+    f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT timezone('utc', now())"
+    for table, columns in {
+        'users': ['created_at'],
+        'leads': ['created_at', 'updated_at'],
+        'integrations': ['created_at'],
+        'integration_status': ['last_checked', 'created_at', 'updated_at'],
+        'onboarding': ['created_at', 'updated_at'],
+        'appointments': ['created_at'],
+        'calls': ['call_time', 'created_at'],
+        'drew_lead_communications': ['created_at', 'updated_at'],
+        'user_lead_communications': ['created_at', 'updated_at'],
+        'user_drew_communications': ['created_at', 'updated_at'],
+    }.items()
+    for column in columns
+]
+
+
 # Initialize database (call this at startup)
 def init_db():
+    # The trigram index on leads.name needs the extension before create_all().
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
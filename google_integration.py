@@ -1,31 +1,88 @@
 # google_integration.py
 import os
+import asyncio
 import base64
-import httplib2
-from datetime import datetime
+import json
+import logging
+import requests
+import threading
+import ciso8601
+from cachetools import TTLCache
+from datetime import datetime, timedelta
+from functools import lru_cache
 from datetime import timezone
 from google.oauth2.credentials import Credentials
-from google_auth_httplib2 import Request as GoogleAuthRequest
+from google.auth.transport.requests import Request as GoogleAuthRequest
 from google_auth_oauthlib.flow import Flow
 import base64
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from googleapiclient.discovery import build
+from email.header import Header
+from email.utils import formataddr, parseaddr
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
+from requests.adapters import HTTPAdapter
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from config import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, REDIRECT_URI, SCOPES
-from models import Integration, IntegrationStatus
+from models import Integration, IntegrationStatus, utc_now
 from database import SessionLocal
 
+logger = logging.getLogger(__name__)
 
-def create_flow():
+# Stored credential dicts keyed by (user_id, platform_name). Entries are dropped
+# whenever the integration is written, and expired credentials are never cached.
+_credentials_cache = TTLCache(maxsize=10_000, ttl=300)
+_credentials_cache_lock = threading.RLock()
+
+# Cached tokens this close to expiry are treated as expired; wider than
+# google-auth's own refresh threshold so a cache hit never needs a refresh.
+TOKEN_EXPIRY_MARGIN = timedelta(minutes=5)
+
+# Token refreshes share one pooled session so TLS connections to
+# oauth2.googleapis.com are kept alive between refreshes.
+_http_session = requests.Session()
+_http_session.mount('https://', HTTPAdapter(pool_connections=50, pool_maxsize=50))
+_google_auth_request = GoogleAuthRequest(_http_session)
+
+HTML_EMAIL_TEMPLATE = (
+    "<!DOCTYPE html>"
+    "<html>"
+    "<head><meta charset='UTF-8'></head>"
+    "<body style='font-family: Arial, sans-serif;'>"
+    "{body}"
+    "</body>"
+    "</html>"
+)
+
+# Parts are base64-encoded, so this boundary can never occur inside them.
+MIME_BOUNDARY = "=_drew_alternative_="
+
+
+@lru_cache(maxsize=None)
+def _discovery_document(service_name, version):
+    # Cached as the JSON text: build_from_document mutates a parsed document,
+    # so each build parses its own copy.
+    return discovery_cache.get_static_doc(service_name, version)
+
+
+def build_service(service_name, version, credentials):
+    """
+    Build a Google API client from the discovery document bundled with
+    googleapiclient, read from disk once per process instead of on every
+    build() call.
+    """
+    document = _discovery_document(service_name, version)
+    if document is None:
+        return build(service_name, version, credentials=credentials, cache_discovery=False)
+    return build_from_document(document, credentials=credentials)
+
+
+def _load_client_config():
     try:
-        return Flow.from_client_secrets_file(
-            'client_secrets.json',
-            scopes=SCOPES,
-            redirect_uri=REDIRECT_URI
-        )
+        with open('client_secrets.json') as f:
+            return json.load(f)
     except FileNotFoundError:
-        print("client_secrets.json not found, using environment variables")
-        client_config = {
+        logger.info("client_secrets.json not found, using environment variables")
+        return {
             "web": {
                 "client_id": GOOGLE_CLIENT_ID,
                 "client_secret": GOOGLE_CLIENT_SECRET,
@@ -34,15 +91,21 @@ def create_flow():
                 "redirect_uris": [REDIRECT_URI]
             }
         }
-        print("Client Config:", client_config)
-        return Flow.from_client_config(client_config, scopes=SCOPES)
+
+
+# Resolved once at import; OAuth flows are built from the in-memory dict.
+_CLIENT_CONFIG = _load_client_config()
+
+
+def create_flow():
+    return Flow.from_client_config(_CLIENT_CONFIG, scopes=SCOPES, redirect_uri=REDIRECT_URI)
 
 
 def save_integration_to_db(credentials, email, user_id):
     """
     Save or update the integration credentials and status for a given user.
+    Both upserts are sent as one statement in a single transaction.
     """
-    db = SessionLocal()
     try:
         credentials_dict = {
             'token': credentials.token,
@@ -54,78 +117,191 @@ def save_integration_to_db(credentials, email, user_id):
             'expiry': credentials.expiry.isoformat() if credentials.expiry else None,
             'email': email
         }
-        with db.begin():
-            integration = db.query(Integration).filter_by(
+        # The integration upsert rides along as a data-modifying CTE; Postgres
+        # executes it even though the outer statement never reads from it, so
+        # both upserts reach the server in one round trip.
+        saved_integration = (
+            pg_insert(Integration)
+            .values(
                 user_id=user_id,
-                platform_name='google_calendar'
-            ).first()
-            if not integration:
-                integration = Integration(
-                    user_id=user_id,
-                    platform_name='google_calendar',
-                    credentials=credentials_dict
-                )
-                db.add(integration)
-            else:
-                integration.credentials = credentials_dict
-
-            integration_status = db.query(IntegrationStatus).filter_by(
-                user_id=user_id,
-                platform_name='google_calendar'
-            ).first()
-            if not integration_status:
-                integration_status = IntegrationStatus(
+                platform_name='google_calendar',
+                credentials=credentials_dict,
+                token=credentials.token,
+                token_expiry=credentials.expiry
+            )
+            .on_conflict_do_update(
+                index_elements=['user_id', 'platform_name'],
+                set_={
+                    'credentials': credentials_dict,
+                    'token': credentials.token,
+                    'token_expiry': credentials.expiry
+                }
+            )
+            .returning(Integration.id)
+            .cte('saved_integration')
+        )
+        with SessionLocal.begin() as db:
+            db.execute(
+                pg_insert(IntegrationStatus)
+                .values(
                     user_id=user_id,
                     platform_name='google_calendar',
                     status='active'
                 )
-                db.add(integration_status)
-            else:
-                integration_status.status = 'active'
-                integration_status.last_checked = datetime.utcnow()
-        db.commit()
+                .on_conflict_do_update(
+                    index_elements=['user_id', 'platform_name'],
+                    # ON CONFLICT DO UPDATE does not apply Column.onupdate.
+                    set_={'status': 'active', 'last_checked': utc_now, 'updated_at': utc_now}
+                )
+                .add_cte(saved_integration)
+            )
+        _invalidate_cached_credentials(user_id)
     except Exception as e:
-        db.rollback()
-        print(f"Error saving integration to database: {e}")
+        logger.error("Error saving integration to database: %s", e)
         raise
-    finally:
-        db.close()
 
 
-def get_user_credentials(user_id, platform_name='google_calendar'):
+def _invalidate_cached_credentials(user_id, platform_name='google_calendar'):
+    with _credentials_cache_lock:
+        _credentials_cache.pop((int(user_id), platform_name), None)
+
+
+def _stored_credentials(integration):
+    """
+    Return the integration's credentials dict with the token columns, which are
+    kept current by refreshes, overlaid on the static credentials JSON. The
+    'expiry' value is always a naive UTC datetime or None.
+    Accepts an Integration or a row projecting those three columns.
+    """
+    if integration.token:
+        return {**integration.credentials, 'token': integration.token, 'expiry': integration.token_expiry}
+    creds_data = dict(integration.credentials)
+    if creds_data.get('expiry'):
+        # Rows saved before the token_expiry column existed keep an ISO string
+        dt = ciso8601.parse_datetime(creds_data['expiry'])
+        # Convert to UTC and remove timezone information to get a naive datetime;
+        # strings without an offset were written from naive UTC values already
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+        creds_data['expiry'] = dt
+    return creds_data
+
+
+def _token_expired(creds_data):
+    expiry = creds_data.get('expiry')
+    return expiry is not None and datetime.utcnow() >= expiry - TOKEN_EXPIRY_MARGIN
+
+
+def _credentials_from_dict(creds_data):
+    """
+    Build a Credentials object from a stored credentials dict.
+    """
+    credentials = Credentials(
+        token=creds_data['token'],
+        refresh_token=creds_data['refresh_token'],
+        token_uri=creds_data['token_uri'],
+        client_id=creds_data['client_id'],
+        client_secret=creds_data['client_secret'],
+        scopes=creds_data['scopes']
+    )
+    credentials.expiry = creds_data.get('expiry')
+    return credentials
+
+
+def get_user_credentials_dict(user_id, platform_name='google_calendar'):
     """
-    Retrieve the stored Google credentials for the given user.
+    Retrieve the stored credentials dict (token, expiry, email, ...) for the given user.
+    This is the hot path for callers that only need the bearer token or the
+    connected email address; it is served from the in-process cache while the
+    cached token is still valid.
     """
+    try:
+        cache_key = (int(user_id), platform_name)
+        with _credentials_cache_lock:
+            creds_data = _credentials_cache.get(cache_key)
+        if creds_data is not None:
+            if not _token_expired(creds_data):
+                return dict(creds_data)
+            _invalidate_cached_credentials(user_id, platform_name)
+    except Exception as e:
+        logger.error("Error reading cached credentials: %s", e)
+        return None
+
     db = SessionLocal()
     try:
-        integration = db.query(Integration).filter_by(
-            user_id=user_id,
-            platform_name=platform_name
+        integration = db.query(
+            Integration.credentials, Integration.token, Integration.token_expiry
+        ).filter(
+            Integration.user_id == user_id,
+            Integration.platform_name == platform_name
         ).first()
         if not integration or not integration.credentials:
             return None
-        creds_data = integration.credentials
-        credentials = Credentials(
-            token=creds_data['token'],
-            refresh_token=creds_data['refresh_token'],
-            token_uri=creds_data['token_uri'],
-            client_id=creds_data['client_id'],
-            client_secret=creds_data['client_secret'],
-            scopes=creds_data['scopes']
-        )
-        if 'expiry' in creds_data and creds_data['expiry']:
-            dt = datetime.fromisoformat(creds_data['expiry'].replace('Z', '+00:00'))
-            # Convert to UTC and remove timezone information to get a naive datetime
-            credentials.expiry = dt.astimezone(timezone.utc).replace(tzinfo=None)
+        creds_data = _stored_credentials(integration)
+        if not _token_expired(creds_data):
+            with _credentials_cache_lock:
+                _credentials_cache[cache_key] = creds_data
 
-        return credentials
+        return dict(creds_data)
     except Exception as e:
-        print(f"Error retrieving credentials from database: {e}")
+        logger.error("Error retrieving credentials from database: %s", e)
         return None
     finally:
         db.close()
 
 
+def get_user_credentials(user_id, platform_name='google_calendar', integration=None):
+    """
+    Retrieve the stored Google credentials for the given user as a Credentials
+    object, for callers that call Google APIs or refresh the token.
+    Callers that already loaded the Integration row can pass it to skip the lookup.
+    """
+    if integration is not None:
+        creds_data = _stored_credentials(integration) if integration.credentials else None
+    else:
+        creds_data = get_user_credentials_dict(user_id, platform_name)
+    if creds_data is None:
+        return None
+    try:
+        return _credentials_from_dict(creds_data)
+    except Exception as e:
+        logger.error("Error building credentials: %s", e)
+        return None
+
+
+def get_user_credentials_bulk(user_ids, platform_name='google_calendar'):
+    """
+    Retrieve the stored Google credentials for many users with a single query.
+    Returns a dict mapping user_id to Credentials; users without an integration
+    are omitted.
+    """
+    if not user_ids:
+        return {}
+    db = SessionLocal()
+    try:
+        integrations = db.query(
+            Integration.user_id, Integration.credentials, Integration.token, Integration.token_expiry
+        ).filter(
+            Integration.platform_name == platform_name,
+            Integration.user_id.in_(user_ids)
+        ).all()
+        credentials_by_user = {}
+        for integration in integrations:
+            if not integration.credentials:
+                continue
+            creds_data = _stored_credentials(integration)
+            credentials_by_user[integration.user_id] = _credentials_from_dict(creds_data)
+            if not _token_expired(creds_data):
+                with _credentials_cache_lock:
+                    _credentials_cache[(integration.user_id, platform_name)] = creds_data
+        return credentials_by_user
+    except Exception as e:
+        logger.error("Error retrieving credentials from database: %s", e)
+        return {}
+    finally:
+        db.close()
+
+
 def refresh_and_save_credentials(user_id, credentials, platform_name='google_calendar'):
     """
     Refresh the credentials if expired and update them in the database.
@@ -133,50 +309,68 @@ def refresh_and_save_credentials(user_id, credentials, platform_name='google_cal
     db = SessionLocal()
     try:
         if not credentials:
-            print(f"No credentials provided for user {user_id}")
+            logger.warning("No credentials provided for user %s", user_id)
             return None
         if not credentials.expired:
-            print(f"Credentials for user {user_id} are not expired")
+            logger.debug("Credentials for user %s are not expired", user_id)
             return credentials
         if not credentials.refresh_token:
-            print(f"No refresh token available for user {user_id}")
+            logger.warning("No refresh token available for user %s", user_id)
             return None
 
-        http_obj = httplib2.Http()
         try:
-            credentials.refresh(GoogleAuthRequest(http_obj))
+            credentials.refresh(_google_auth_request)
         except Exception as refresh_error:
-            print(f"Credential refresh failed for user {user_id}: {str(refresh_error)}")
-            print(f"Existing token details: {credentials.__dict__}")
+            logger.error("Credential refresh failed for user %s: %s", user_id, refresh_error)
             return None
 
-        integration = db.query(Integration).filter_by(
-            user_id=user_id,
-            platform_name=platform_name
-        ).first()
-        if integration:
-            try:
-                integration.credentials = {
-                    'token': credentials.token,
-                    'refresh_token': credentials.refresh_token,
-                    'token_uri': credentials.token_uri,
-                    'client_id': credentials.client_id,
-                    'client_secret': credentials.client_secret,
-                    'scopes': credentials.scopes,
-                    'expiry': credentials.expiry.isoformat() if credentials.expiry else None
-                }
-                db.commit()
-            except Exception as db_error:
-                print(f"Failed to update credentials in database for user {user_id}: {str(db_error)}")
-                db.rollback()
+        try:
+            db.execute(
+                update(Integration)
+                .where(
+                    Integration.user_id == user_id,
+                    Integration.platform_name == platform_name
+                )
+                .values(token=credentials.token, token_expiry=credentials.expiry)
+            )
+            db.commit()
+            _invalidate_cached_credentials(user_id, platform_name)
+        except Exception as db_error:
+            logger.error("Failed to update credentials in database for user %s: %s", user_id, db_error)
+            db.rollback()
         return credentials
     except Exception as e:
-        print(f"Unexpected error in credential refresh for user {user_id}: {str(e)}")
+        logger.exception("Unexpected error in credential refresh for user %s: %s", user_id, e)
         return None
     finally:
         db.close()
 
 
+def _encode_header(value):
+    """
+    Render a header value for the raw message, RFC 2047-encoding it only when it
+    is not plain ASCII. Line breaks are removed to prevent header injection;
+    long encoded values are folded with CRLF like the rest of the message.
+    """
+    value = str(value).replace('\r', ' ').replace('\n', ' ')
+    return value if value.isascii() else Header(value, 'utf-8').encode(linesep='\r\n')
+
+
+def _encode_address(value):
+    value = str(value).replace('\r', ' ').replace('\n', ' ')
+    return value if value.isascii() else formataddr(parseaddr(value), charset='utf-8')
+
+
+def _encode_part(content_type, content):
+    return (
+        f"--{MIME_BOUNDARY}\r\n"
+        f'Content-Type: {content_type}; charset="utf-8"\r\n'
+        "Content-Transfer-Encoding: base64\r\n"
+        "\r\n"
+        + base64.encodebytes(content.encode('utf-8')).decode('ascii').replace('\n', '\r\n')
+    )
+
+
 def send_email_notification(credentials, sender_email, recipient_email, event_details):
     """
     Compose and send an email notification using the drafted email content.
@@ -184,11 +378,7 @@ def send_email_notification(credentials, sender_email, recipient_email, event_de
     email clients render the HTML instead of showing raw markup.
     """
     try:
-        # Create a multipart/alternative message container.
-        message = MIMEMultipart("alternative")
-        message["to"] = recipient_email
-        message["from"] = sender_email
-        message["subject"] = f"Calendar Invitation: {event_details['summary']}"
+        subject = f"Calendar Invitation: {event_details['summary']}"
 
         # 1. Build the plain-text version.
         # (This is a fallback in case the email client does not support HTML.)
@@ -198,30 +388,43 @@ def send_email_notification(credentials, sender_email, recipient_email, event_de
             f"Meeting Link: {event_details.get('html_link', 'N/A')}\n\n"
             "This is an automated message. Please do not reply."
         )
-        text_part = MIMEText(text_content, "plain")
-        message.attach(text_part)
 
         # 2. Build the HTML version.
-        html_content = (
-            "<!DOCTYPE html>"
-            "<html>"
-            "<head><meta charset='UTF-8'></head>"
-            "<body style='font-family: Arial, sans-serif;'>"
-            f"{event_details.get('description', 'No additional details provided.')}"
-            "</body>"
-            "</html>"
+        html_content = HTML_EMAIL_TEMPLATE.format(
+            body=event_details.get('description', 'No additional details provided.')
+        )
+
+        # 3. Assemble the multipart/alternative message directly as RFC 5322 text.
+        message = (
+            f"To: {_encode_address(recipient_email)}\r\n"
+            f"From: {_encode_address(sender_email)}\r\n"
+            f"Subject: {_encode_header(subject)}\r\n"
+            "MIME-Version: 1.0\r\n"
+            f'Content-Type: multipart/alternative; boundary="{MIME_BOUNDARY}"\r\n'
+            "\r\n"
+            + _encode_part("text/plain", text_content)
+            + _encode_part("text/html", html_content)
+            + f"--{MIME_BOUNDARY}--\r\n"
         )
-        html_part = MIMEText(html_content, "html")
-        message.attach(html_part)
 
-        # 3. Encode and send the email.
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode("utf-8")
-        gmail_service = build("gmail", "v1", credentials=credentials)
+        # 4. Encode and send the email.
+        raw_message = base64.urlsafe_b64encode(message.encode('ascii')).decode("utf-8")
+        gmail_service = build_service("gmail", "v1", credentials)
         sent_message = gmail_service.users().messages().send(
             userId="me", body={"raw": raw_message}
         ).execute()
 
         return True
     except Exception as e:
-        print(f"Error sending email: {e}")
+        logger.error("Error sending email: %s", e)
         return False
+
+
+async def send_email_notification_async(credentials, sender_email, recipient_email, event_details):
+    """
+    Async variant of send_email_notification for coroutine callers. The blocking
+    googleapiclient send runs in a worker thread so the event loop stays free.
+    """
+    return await asyncio.to_thread(
+        send_email_notification, credentials, sender_email, recipient_email, event_details
+    )
@@ -0,0 +1,31 @@
+# http_client.py
+from typing import Optional
+
+import httpx
+
+# One AsyncClient for the whole process so outbound webhooks reuse pooled
+# keep-alive connections. Created on first use and closed on app shutdown.
+_client: Optional[httpx.AsyncClient] = None
+
+POOL_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60.0)
+# Only failed connection attempts are retried: the request never reached the
+# webhook, so a POST cannot be delivered twice.
+CONNECT_RETRIES = 2
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(15.0),
+            limits=POOL_LIMITS,
+            transport=httpx.AsyncHTTPTransport(limits=POOL_LIMITS, retries=CONNECT_RETRIES)
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -1,8 +1,14 @@
 # main.py
+import logging
+
 import uvicorn
 from fastapi import FastAPI
 from routes import router as api_router
 from database import init_db
+from http_client import close_http_client
+from task_queue import close_task_queue
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
 app = FastAPI()
 app.include_router(api_router)
@@ -12,5 +18,11 @@ app.include_router(api_router)
 async def startup():
     init_db()
 
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_http_client()
+    await close_task_queue()
+
 if __name__ == '__main__':
     uvicorn.run("main:app", host="0.0.0.0", port=5000, reload=True)
@@ -1,24 +1,34 @@
-from datetime import datetime
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Computed, Integer, String, Boolean, DateTime, ForeignKey, Index, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import backref, relationship
 from database import Base
 
+# First word of a name, maintained by Postgres so drafters need not split names.
+FIRST_NAME_SQL = "split_part(btrim(name), ' ', 1)"
+
+# Timestamps are generated by Postgres as naive UTC, matching the values the
+# application compares them against.
+utc_now = func.timezone('utc', func.now())
+
 
 class User(Base):
     __tablename__ = 'users'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String, nullable=False)
+    first_name = Column(String, Computed(FIRST_NAME_SQL, persisted=True))
     email = Column(String, unique=True, nullable=False)
     password = Column(String, nullable=False)
     phone = Column(String)
     brokerage_name = Column(String)
     drew_name = Column(String)
     role = Column(String, default='user')
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now)
     is_active = Column(Boolean, default=False)
     is_verified = Column(Boolean, default=False)
-    drew_voice_accent = Column(JSON)
+    drew_voice_accent = Column(JSONB)
+    # Invitations are rendered from a template unless the user opts in to OpenAI drafting.
+    use_ai_drafting = Column(Boolean, nullable=False, server_default=text('false'))
     package_id = Column(Integer, ForeignKey('packages.id'))
 
     # Relationships
@@ -29,40 +39,55 @@ class User(Base):
 
 class Lead(Base):
     __tablename__ = 'leads'
+    __table_args__ = (
+        # Serves the substring ILIKE lookups on lead names (needs pg_trgm).
+        Index('ix_lead_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('ix_lead_user_created', 'user_id', text('created_at DESC')),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     external_id = Column(String(255))
     source = Column(String(50))
     name = Column(String(255))
+    first_name = Column(String, Computed(FIRST_NAME_SQL, persisted=True))
     email = Column(String(255))
     phone = Column(String(20))
     status = Column(String(50))
-    lead_details = Column(JSON)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    lead_details = Column(JSONB)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
 
 
 class Integration(Base):
     __tablename__ = 'integrations'
+    __table_args__ = (
+        Index('ix_integration_user_platform', 'user_id', 'platform_name', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     platform_name = Column(String(100))
-    credentials = Column(JSON)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    credentials = Column(JSONB)
+    # Refreshes only rewrite these two columns; the remaining credentials JSON is static.
+    token = Column(String)
+    token_expiry = Column(DateTime)
+    created_at = Column(DateTime, server_default=utc_now)
 
 
 class IntegrationStatus(Base):
     __tablename__ = 'integration_status'
+    __table_args__ = (
+        Index('ix_integration_status_user_platform', 'user_id', 'platform_name', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     platform_name = Column(String(100))
     status = Column(String(50))
-    last_checked = Column(DateTime, default=datetime.utcnow)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_checked = Column(DateTime, server_default=utc_now)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
 
 
 class Onboarding(Base):
@@ -71,45 +96,54 @@ class Onboarding(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     current_step = Column(Integer, default=1)
-    crm_credentials = Column(JSON)
-    scheduling_preferences = Column(JSON)
+    crm_credentials = Column(JSONB)
+    scheduling_preferences = Column(JSONB)
     communication_tone = Column(String)
     completed = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
 
 
 class Appointment(Base):
     __tablename__ = 'appointments'
+    __table_args__ = (
+        Index('ix_appointment_user_time', 'user_id', 'appointment_time'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     appointment_time = Column(DateTime)
     status = Column(String(50))
-    participant_details = Column(JSON)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    participant_details = Column(JSONB)
+    created_at = Column(DateTime, server_default=utc_now)
 
-    # Relationship with User
-    user = relationship('User', backref='appointments', lazy=True)
+    # Relationship with User; the reverse collection must be loaded explicitly
+    user = relationship('User', backref=backref('appointments', lazy='raise_on_sql', passive_deletes=True), lazy=True)
 
 
 class Call(Base):
     __tablename__ = 'calls'
+    __table_args__ = (
+        Index('ix_call_user_created', 'user_id', text('created_at DESC')),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
-    call_time = Column(DateTime, default=datetime.utcnow)
+    call_time = Column(DateTime, server_default=utc_now)
     status = Column(String(50))
     duration = Column(Integer)
     call_id = Column(String(50))
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now)
 
-    # Relationship with User
-    user = relationship('User', backref='calls', lazy=True)
+    # Relationship with User; the reverse collection must be loaded explicitly
+    user = relationship('User', backref=backref('calls', lazy='raise_on_sql', passive_deletes=True), lazy=True)
 
 
 class DrewLeadCommunication(Base):
     __tablename__ = 'drew_lead_communications'
+    __table_args__ = (
+        Index('ix_dlc_user_created', 'user_id', text('created_at DESC')),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'))
@@ -117,30 +151,33 @@ class DrewLeadCommunication(Base):
     lead_id = Column(Integer, ForeignKey('leads.id', ondelete='SET NULL'))
     type = Column(String(20))
     status = Column(String(20))
-    details = Column(JSON)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    details = Column(JSONB)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
 
-    # Relationships
-    user = relationship('User', backref='drew_lead_communications', lazy=True)
-    lead = relationship('Lead', backref='drew_communications', lazy=True)
+    # Relationships; the reverse collections must be loaded explicitly
+    user = relationship('User', backref=backref('drew_lead_communications', lazy='raise_on_sql'), lazy=True)
+    lead = relationship('Lead', backref=backref('drew_communications', lazy='raise_on_sql', passive_deletes=True), lazy=True)
 
 
 class UserLeadCommunication(Base):
     __tablename__ = 'user_lead_communications'
+    __table_args__ = (
+        Index('ix_ulc_user_created', 'user_id', text('created_at DESC')),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     lead_id = Column(Integer, ForeignKey('leads.id', ondelete='SET NULL'))
     type = Column(String(20))
     status = Column(String(20))
-    details = Column(JSON)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    details = Column(JSONB)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
 
-    # Relationships
-    user = relationship('User', backref='user_lead_communications', lazy=True)
-    lead = relationship('Lead', backref='user_communications', lazy=True)
+    # Relationships; the reverse collections must be loaded explicitly
+    user = relationship('User', backref=backref('user_lead_communications', lazy='raise_on_sql'), lazy=True)
+    lead = relationship('Lead', backref=backref('user_communications', lazy='raise_on_sql', passive_deletes=True), lazy=True)
 
 
 class UserDrewCommunication(Base):
@@ -151,9 +188,23 @@ class UserDrewCommunication(Base):
     drew_id = Column(String(50))
     type = Column(String(20))
     status = Column(String(20))
-    details = Column(JSON)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    details = Column(JSONB)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
 
-    # Relationships
-    user = relationship('User', backref='user_drew_communications', lazy=True)
+    # Relationships; the reverse collections must be loaded explicitly
+    user = relationship('User', backref=backref('user_drew_communications', lazy='raise_on_sql'), lazy=True)
+
+
+class BulkDraftJob(Base):
+    __tablename__ = 'bulk_draft_jobs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    batch_id = Column(String(100), nullable=False)
+    status = Column(String(20))
+    message_content = Column(String)
+    # Drafted message per lead id, filled in once the batch completes
+    results = Column(JSONB)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
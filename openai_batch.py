@@ -0,0 +1,64 @@
+# openai_batch.py
+import json
+
+from openai import OpenAI
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+PENDING_STATUSES = {"validating", "in_progress", "finalizing"}
+
+client = OpenAI()
+
+
+def submit_batch(requests):
+    """
+    Upload chat completion requests as a JSONL file and start an OpenAI batch.
+
+    Each request is a dict with a unique 'custom_id' and the chat completion
+    'body' (model, messages, ...). Returns the batch id.
+    """
+    lines = "\n".join(
+        json.dumps({
+            "custom_id": request["custom_id"],
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": request["body"]
+        })
+        for request in requests
+    )
+    batch_file = client.files.create(
+        file=("batch.jsonl", lines.encode("utf-8")),
+        purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h"
+    )
+    return batch.id
+
+
+def poll_batch(batch_id):
+    """
+    Check an OpenAI batch once.
+
+    Returns a (status, results) tuple. results is None while the batch is still
+    running or if it did not complete; otherwise it maps each custom_id to the
+    completion text, or to None when that request failed.
+    """
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        return batch.status, None
+
+    results = {}
+    if batch.output_file_id:
+        output = client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                results[item["custom_id"]] = None
+                continue
+            results[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"].strip()
+    return batch.status, results
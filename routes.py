@@ -1,17 +1,27 @@
 # routes.py
-import json
+import asyncio
+import logging
 import os
+import secrets
+import threading
+from collections import Counter
+from functools import partial
 from typing import Dict, Any
 
+import anyio
+import ciso8601
+from cachetools import TTLCache
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from jinja2 import Environment, FileSystemLoader
+
 import openai
+import orjson
 from datetime import datetime
 from datetime import datetime, timedelta
 
-import requests
-from fastapi import APIRouter, Request, HTTPException, BackgroundTasks, Depends
+from fastapi import APIRouter, Request, Response, HTTPException, BackgroundTasks, Depends
 from fastapi.responses import HTMLResponse, JSONResponse
-from googleapiclient.discovery import build
-from sqlalchemy import func
+from sqlalchemy import and_, case, delete, func, insert, select, literal, union_all
 from sqlalchemy.orm import Session
 
 from database import get_db, SessionLocal
@@ -22,58 +32,133 @@ from models import (
     DrewLeadCommunication,
     UserLeadCommunication,
     UserDrewCommunication,
-    User, Integration
+    User,
+    BulkDraftJob
 )
 from google_integration import (
     create_flow,
     save_integration_to_db,
     get_user_credentials,
-    refresh_and_save_credentials, send_email_notification
+    get_user_credentials_dict,
+    refresh_and_save_credentials, send_email_notification_async,
+    build_service
 )
+from openai_batch import submit_batch, poll_batch, PENDING_STATUSES
+from ai_cache import get_or_draft
+from http_client import get_http_client
+from task_queue import enqueue_job
+from config import Settings, get_settings
+from schemas import BookAppointmentRequest, ContactMatch, LeadMatch
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+# Shorter search terms match most of a user's leads and give the trigram
+# index too little to narrow on, so /search_leads rejects them.
+MIN_SEARCH_TERM_LENGTH = 2
+
+
+def orjson_response(body, status_code=200):
+    """
+    Return a JSON response from body, either a payload to serialize with orjson
+    (which handles datetimes natively) or bytes it already produced.
+    """
+    if not isinstance(body, bytes):
+        body = orjson.dumps(body)
+    return Response(body, status_code=status_code, media_type="application/json")
+
+
+def lead_name_matches(search_term):
+    """
+    Case-insensitive substring match on Lead.name, served by the pg_trgm index
+    ix_lead_name_trgm. LIKE wildcards in the term are escaped so that '%' or '_'
+    typed by a caller match literally instead of widening the search.
+    """
+    escaped = str(search_term).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return Lead.name.ilike(f"%{escaped}%", escape='\\')
+
+
+# The lead fields the lookup flows respond with or hand to their background tasks.
+LEAD_MATCH_COLUMNS = (Lead.id, Lead.name, Lead.first_name, Lead.email, Lead.phone, Lead.status, Lead.source)
+
+
+def find_matching_leads(db, user_id, name):
+    """
+    Return the user's leads whose name contains name, as rows of
+    LEAD_MATCH_COLUMNS. Two rows are enough to tell a unique match from an
+    ambiguous one, so the full list is only read when there are several.
+    """
+    query = db.query(*LEAD_MATCH_COLUMNS).filter(Lead.user_id == user_id, lead_name_matches(name))
+    matches = query.limit(2).all()
+    if len(matches) > 1:
+        matches = query.all()
+    return matches
+
+
+def match_list(schema, matches):
+    """Serialize find_matching_leads rows for a multiple-matches response."""
+    return [schema.model_validate(match).model_dump() for match in matches]
+
 
 @router.get("/", response_class=HTMLResponse)
-async def home(request: Request, user_id: str = None):
-    from config import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET
-    if not GOOGLE_CLIENT_ID or not GOOGLE_CLIENT_SECRET:
+async def home(request: Request, user_id: str = None, settings: Settings = Depends(get_settings)):
+    if not settings.google_client_id or not settings.google_client_secret:
         raise HTTPException(
             status_code=400,
             detail="Missing Google credentials. Please check your .env file."
         )
+    if not settings.state_secret:
+        raise HTTPException(
+            status_code=400,
+            detail="Missing STATE_SECRET. Please check your .env file."
+        )
     if not user_id:
         raise HTTPException(status_code=400, detail="Missing user_id parameter")
 
     flow = create_flow()
-    state_data = {'user_id': user_id, 'prompt': 'consent'}
+    # The signature only stops the state being altered or replayed after
+    # STATE_MAX_AGE. This endpoint does not authenticate the caller, so it
+    # does not prove the requester owns user_id.
     authorization_url, state = flow.authorization_url(
         access_type='offline',
         include_granted_scopes='true',
         prompt='consent',
-        state=json.dumps(state_data)
+        state=_state_signer(settings).dumps({'user_id': user_id})
     )
     return f'<a href="{authorization_url}">Connect with Google Calendar</a>'
 
 
+# How long a signed OAuth state stays valid, in seconds.
+STATE_MAX_AGE = 600
+
+
+def _state_signer(settings: Settings):
+    return URLSafeTimedSerializer(settings.state_secret, salt='oauth')
+
+
 @router.get("/oauth/google/callback")
-async def google_callback(request: Request):
+async def google_callback(request: Request, settings: Settings = Depends(get_settings)):
     try:
-        flow = create_flow()
-        state_json = request.query_params.get('state', '{}')
-        state_data = json.loads(state_json)
-        user_id = state_data.get('user_id')
-        if not user_id:
+        state = request.query_params.get('state')
+        if not state or not settings.state_secret:
             raise HTTPException(status_code=400, detail="No user ID provided")
+        try:
+            user_id = _state_signer(settings).loads(state, max_age=STATE_MAX_AGE)['user_id']
+        except BadSignature:
+            raise HTTPException(status_code=400, detail="Invalid or expired state")
         code = request.query_params.get('code')
         if not code:
             raise HTTPException(status_code=400, detail="No authorization code received")
 
+        # The token exchange, userinfo lookup and save are blocking calls, so
+        # they run in worker threads.
+        flow = create_flow()
         authorization_response = str(request.url)
-        flow.fetch_token(authorization_response=authorization_response)
+        await asyncio.to_thread(flow.fetch_token, authorization_response=authorization_response)
         credentials = flow.credentials
 
         if not credentials.refresh_token:
@@ -84,27 +169,27 @@ async def google_callback(request: Request):
                 }
             )
 
-        service = build('oauth2', 'v2', credentials=credentials)
-        try:
-            user_info = service.userinfo().get().execute()
-            email = user_info.get('email')
-            if not email:
-                raise HTTPException(status_code=400, detail="Could not get user email")
-        except Exception as e:
-            print(f"Error getting user info: {str(e)}")
-            email = f"user_{datetime.now().timestamp()}"
+        user_info = await asyncio.to_thread(
+            lambda: build_service('oauth2', 'v2', credentials).userinfo().get().execute()
+        )
+        email = user_info.get('email')
+        if not email:
+            raise HTTPException(status_code=400, detail="Could not get user email")
 
-        # save_integration_to_db should handle its own db session or be updated similarly.
-        save_integration_to_db(credentials, email, int(user_id))
+        await asyncio.to_thread(save_integration_to_db, credentials, email, int(user_id))
         return {"status": "success", "message": "Successfully connected to Google Calendar", "user_id": user_id}
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in callback: {str(e)}")
+        logger.exception("Error in callback: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-client = OpenAI()
+client = AsyncOpenAI()
+# Caps concurrent OpenAI requests across all drafters to stay inside rate limits.
+openai_semaphore = asyncio.Semaphore(20)
 
 
 def clean_generated_email(email_text: str) -> str:
@@ -127,49 +212,135 @@ def clean_generated_email(email_text: str) -> str:
     return email_text
 
 
-def draft_sms_via_ai(user, lead, message_content):
-    """
-    Uses the OpenAI Chat API to generate a concise and professional SMS message.
+# The instructions that never change live in the system messages, so every
+# request shares the same prefix and only the trailing user message varies.
+SMS_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": (
+        "You are a professional assistant that drafts concise and creative SMS messages. "
+        "Include a friendly greeting, mention the sender's brokerage by its actual name, "
+        "and sign off using the sender's first name. "
+        "Do not include any placeholder text such as [brokerage_name] or invent additional contact details."
+    )
+}
+
+EMAIL_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": (
+        "You are a professional email assistant that drafts creative, HTML-formatted email messages. "
+        "Begin with a greeting like: 'Hello, this is <b>(sender name)</b> from <b>(brokerage name)</b>.', "
+        "using the actual names given, then address the recipient by name. "
+        "Ensure no placeholder text (such as [brokerage_name]) is used and do not invent additional contact details."
+    )
+}
+
+INVITATION_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": (
+        "You are a professional email assistant who drafts HTML-formatted email invitations. "
+        "Begin with a greeting like: 'Hello, this is <b>(sender name)</b> from <b>(brokerage name)</b>.', "
+        "using the actual names given, then mention the meeting type and time and incorporate the details provided. "
+        "Ensure key details are emphasized using <b> tags, and do not include any placeholder text such as [brokerage_name]."
+    )
+}
 
-    The SMS message:
-      - Greets the lead by their first name.
-      - Mentions the sender's brokerage using its actual name.
-      - Signs off with the sender's first name.
-      - Incorporates the provided message content.
 
-    No placeholder text (such as [brokerage_name]) or invented contact details should appear.
+async def _complete(messages, user_id):
+    async with openai_semaphore:
+        completion = await client.chat.completions.create(
+            model="gpt-4o",
+            temperature=0.4,
+            messages=messages,
+            user=str(user_id)
+        )
+    return completion.choices[0].message.content.strip()
+
+
+async def _complete_email(messages, user_id):
     """
-    # Extract first names for clarity
-    sender_first_name = user.name.split()[0]
-    lead_first_name = lead.name.split()[0]
+    Stream an HTML email completion and return it cleaned. Tokens are collected
+    as they arrive instead of waiting on one response for the whole body.
+    """
+    async with openai_semaphore:
+        stream = await client.chat.completions.create(
+            model="gpt-4o",
+            temperature=0.4,
+            messages=messages,
+            user=str(user_id),
+            stream=True
+        )
+        chunks = []
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                chunks.append(chunk.choices[0].delta.content)
+    return clean_generated_email("".join(chunks))
 
-    messages = [
-        {
-            "role": "system",
-            "content": "You are a professional assistant that drafts concise and creative SMS messages."
-        },
+
+def _build_sms_messages(user, lead, message_content):
+    # first_name is a generated column; fall back to the full name if it is empty
+    sender_first_name = user.first_name or user.name
+    lead_first_name = lead.first_name or lead.name
+
+    return [
+        SMS_SYSTEM_MESSAGE,
         {
             "role": "user",
             "content": (
                 f"Generate a concise SMS message addressed to {lead_first_name}. "
-                f"Include a friendly greeting and incorporate the following content: {message_content}. "
-                f"Mention the sender's brokerage, {user.brokerage_name}, appropriately. "
-                f"Sign off the message using the sender's first name: {sender_first_name}. "
-                "Do not include any placeholder text such as [brokerage_name] or invent additional contact details."
+                f"Sender's brokerage: {user.brokerage_name}. Sender's first name: {sender_first_name}. "
+                f"Incorporate the following content: {message_content}"
             )
         }
     ]
 
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        temperature=0.4,
-        messages=messages
-    )
-    sms_text = completion.choices[0].message.content.strip()
+
+def _build_email_messages(user, lead, message_content):
+    return [
+        EMAIL_SYSTEM_MESSAGE,
+        {
+            "role": "user",
+            "content": (
+                f"Sender: {user.name} from {user.brokerage_name}. Recipient: {lead.name}. "
+                f"Incorporate the following content: {message_content}"
+            )
+        }
+    ]
+
+
+def _build_invitation_messages(user, meeting_type, meeting_time, additional_description, meeting_details):
+    return [
+        INVITATION_SYSTEM_MESSAGE,
+        {
+            "role": "user",
+            "content": (
+                f"Sender: {user.name} from {user.brokerage_name}. "
+                f"Draft an invitation for a {meeting_type} meeting at {meeting_time.strftime('%I:%M %p on %B %d, %Y')} "
+                f"with the following details: {meeting_details}. "
+                f"Incorporate the following additional details: {additional_description}"
+            )
+        }
+    ]
+
+
+async def draft_sms_via_ai(user, lead, message_content):
+    """
+    Uses the OpenAI Chat API to generate a concise and professional SMS message.
+
+    The SMS message:
+      - Greets the lead by their first name.
+      - Mentions the sender's brokerage using its actual name.
+      - Signs off with the sender's first name.
+      - Incorporates the provided message content.
+
+    No placeholder text (such as [brokerage_name]) or invented contact details should appear.
+    """
+    messages = _build_sms_messages(user, lead, message_content)
+
+    sms_text = await get_or_draft(f"sms:{user.id}", messages, lambda: _complete(messages, user.id))
     return sms_text
 
 
-def draft_email_message_via_ai(user, lead, message_content):
+async def draft_email_message_via_ai(user, lead, message_content):
     """
     Uses the OpenAI Chat API to generate a professional HTML-formatted email message.
 
@@ -180,33 +351,12 @@ def draft_email_message_via_ai(user, lead, message_content):
 
     Ensure no placeholder text (e.g., [brokerage_name]) is used and do not invent additional contact details.
     """
-    messages = [
-        {
-            "role": "system",
-            "content": "You are a professional email assistant that drafts creative, HTML-formatted email messages."
-        },
-        {
-            "role": "user",
-            "content": (
-                f"Generate an HTML-formatted email message that begins with a greeting like: "
-                f"'Hello, this is <b>{user.name}</b> from <b>{user.brokerage_name}</b>.' "
-                f"Address the email to {lead.name} and incorporate the following content: {message_content}. "
-                "Ensure no placeholder text (such as [brokerage_name]) is used and do not invent additional contact details."
-            )
-        }
-    ]
+    messages = _build_email_messages(user, lead, message_content)
 
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        temperature=0.4,
-        messages=messages
-    )
-    email_text = completion.choices[0].message.content.strip()
-    cleaned_message = clean_generated_email(email_text)
-    return cleaned_message
+    return await get_or_draft(f"email:{user.id}", messages, lambda: _complete_email(messages, user.id))
 
 
-def draft_email_via_ai(user, meeting_type, meeting_time, additional_description, meeting_details):
+async def draft_email_via_ai(user, meeting_type, meeting_time, additional_description, meeting_details):
     """
     Uses the OpenAI Chat API to generate a custom, professional HTML-formatted email invitation.
 
@@ -218,213 +368,227 @@ def draft_email_via_ai(user, meeting_type, meeting_time, additional_description,
 
     Do not use any placeholder text (such as [brokerage_name]) and do not invent extra contact details.
     """
-    messages = [
-        {
-            "role": "system",
-            "content": "You are a professional email assistant who drafts HTML-formatted email invitations."
-        },
-        {
-            "role": "user",
-            "content": (
-                f"Draft a professional HTML-formatted email invitation for a {meeting_type} meeting with the following details: {meeting_details}. "
-                f"Begin with a greeting like: 'Hello, this is <b>{user.name}</b> from <b>{user.brokerage_name}</b>.' "
-                f"Then mention that we are scheduling a {meeting_type} meeting at {meeting_time.strftime('%I:%M %p on %B %d, %Y')}. "
-                f"Incorporate the following additional details: {additional_description}. "
-                "Ensure key details are emphasized using <b> tags, and do not include any placeholder text such as [brokerage_name]."
-            )
-        }
-    ]
+    messages = _build_invitation_messages(
+        user, meeting_type, meeting_time, additional_description, meeting_details
+    )
 
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        temperature=0.4,
-        messages=messages
+    cleaned_message = await get_or_draft(
+        f"invitation:{user.id}", messages, lambda: _complete_email(messages, user.id)
     )
-    message_content = completion.choices[0].message.content.strip()
-    cleaned_message = clean_generated_email(message_content)
     subject = f"{meeting_type.capitalize()} Meeting Invitation"
     return {"subject": subject, "body": cleaned_message}
 
 
-@router.post("/book_appointment")
-async def book_appointment(request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+# Compiled templates are cached by the environment, so each file is parsed once.
+templates = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), 'templates')),
+    autoescape=True
+)
+
+
+def render_invitation_template(user, meeting_type, meeting_time, meeting_details, additional_description):
+    """
+    Render the invitation email from templates/invitation.html.j2.
+
+    The default for users without use_ai_drafting: same structure as the
+    AI-drafted invitation, but instant and deterministic.
+    """
+    body = templates.get_template('invitation.html.j2').render(
+        user=user,
+        meeting_type=meeting_type,
+        meeting_time=meeting_time,
+        additional_description=additional_description,
+        meeting_link=meeting_details.get("meeting_link")
+    )
+    subject = f"{meeting_type.capitalize()} Meeting Invitation"
+    return {"subject": subject, "body": body}
+
+
+def render_meet_link(meeting_link):
+    """Render the "Join the Google Meet" paragraph used by the invitation template."""
+    return templates.get_template('meet_link.html.j2').render(meeting_link=meeting_link)
+
+
+def draft_emails_batch(db, user, leads, message_content):
+    """
+    Queue email drafts for many leads on the OpenAI Batch API.
+
+    Used for bulk outreach where latency does not matter: batch requests are
+    billed at a discount and draw on a separate rate-limit pool. Returns the
+    BulkDraftJob tracking the batch; reap_bulk_draft_jobs() collects the drafts.
+    """
+    batch_id = submit_batch([{
+        "custom_id": str(lead.id),
+        "body": {
+            "model": "gpt-4o",
+            "temperature": 0.4,
+            "messages": _build_email_messages(user, lead, message_content),
+            "user": str(user.id)
+        }
+    } for lead in leads])
+    job = BulkDraftJob(
+        user_id=user.id,
+        batch_id=batch_id,
+        status="submitted",
+        message_content=message_content
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def reap_bulk_draft_jobs():
+    """
+    Poll every unfinished BulkDraftJob once and store the drafted emails of the
+    batches that finished. Run every few minutes by the arq worker
+    (worker.WorkerSettings.cron_jobs).
+    """
+    db = SessionLocal()
     try:
-        data = await request.json()
-        required_fields = ['user_id', 'lead_name', 'start_time']
-        if not all(field in data for field in required_fields):
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "status": "error",
-                    "message": "Missing required fields. Please provide user_id, lead_name, and start_time.",
-                    "required_fields": required_fields
+        jobs = db.query(BulkDraftJob).filter(
+            BulkDraftJob.status.in_(['submitted', *PENDING_STATUSES])
+        ).all()
+        for job in jobs:
+            status, results = poll_batch(job.batch_id)
+            job.status = status
+            if results is not None:
+                job.results = {
+                    lead_id: clean_generated_email(text) if text else None
+                    for lead_id, text in results.items()
                 }
-            )
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.exception("Error reaping bulk draft jobs: %s", e)
+    finally:
+        db.close()
 
-        # Query for the matching lead
-        matching_leads = db.query(Lead).filter(
-            Lead.user_id == data['user_id'],
-            Lead.name.ilike(f"%{data['lead_name']}%")
-        ).all()
+
+def bulk_book(db, bookings):
+    """
+    Insert the communication and appointment records for many bookings with
+    one multi-row INSERT per table, committed together.
+
+    Each booking is a dict with user_id, lead_id, lead_name, appointment_time
+    and meeting_details. Returns a (communication_id, appointment_id) pair per
+    booking, in order.
+    """
+    if not bookings:
+        return []
+    communication_ids = db.execute(insert(DrewLeadCommunication).values([{
+        "user_id": booking["user_id"],
+        "lead_id": booking["lead_id"],
+        "drew_id": "agent_drew",
+        "type": "MEETING",
+        "status": "SCHEDULED",
+        "details": booking["meeting_details"]
+    } for booking in bookings]).returning(DrewLeadCommunication.id)).scalars().all()
+    appointment_ids = db.execute(insert(Appointment).values([{
+        "user_id": booking["user_id"],
+        "appointment_time": booking["appointment_time"],
+        "status": "scheduled",
+        "participant_details": {
+            "lead": {
+                "id": booking["lead_id"],
+                "name": booking["lead_name"],
+                "meeting_details": booking["meeting_details"],
+                "duration": 3600
+            }
+        }
+    } for booking in bookings]).returning(Appointment.id)).scalars().all()
+    db.commit()
+    return list(zip(communication_ids, appointment_ids))
+
+
+@router.post("/book_appointment")
+def book_appointment(payload: BookAppointmentRequest, db: Session = Depends(get_db)):
+    # The body is parsed and validated by FastAPI before the handler runs, so a
+    # malformed request never reaches the database.
+    description = payload.description if payload.description is not None else 'Scheduled meeting'
+    try:
+        matching_leads = find_matching_leads(db, payload.user_id, payload.lead_name)
 
         if not matching_leads:
             return JSONResponse(
                 status_code=404,
                 content={
                     "status": "error",
-                    "message": f"No leads found with the name '{data['lead_name']}'.",
-                    "context_for_llm": f"I couldn't find any leads matching the name '{data['lead_name']}' in the database.",
+                    "message": f"No leads found with the name '{payload.lead_name}'.",
+                    "context_for_llm": f"I couldn't find any leads matching the name '{payload.lead_name}' in the database.",
                     "suggestion": "Consider creating a new lead on the dashboard before scheduling an appointment."
                 }
             )
         if len(matching_leads) > 1:
-            leads_info = [{
-                "lead_id": lead.id,
-                "name": lead.name,
-                "email": lead.email,
-                "phone": lead.phone,
-                "status": lead.status,
-                "source": lead.source
-            } for lead in matching_leads]
+            leads_info = match_list(LeadMatch, matching_leads)
             return JSONResponse(
                 status_code=300,
                 content={
                     "status": "multiple_matches",
-                    "message": f"Found {len(matching_leads)} leads with the name '{data['lead_name']}'.",
+                    "message": f"Found {len(matching_leads)} leads with the name '{payload.lead_name}'.",
                     "context_for_llm": "Please provide additional information to identify the specific lead.",
                     "matching_leads": leads_info
                 }
             )
 
         lead = matching_leads[0]
-        start_time = datetime.fromisoformat(data['start_time'].replace('Z', '+00:00'))
+        start_time = payload.start_time
         end_time = start_time + timedelta(hours=1)
 
         # Prepare meeting details; if no location is provided, assume Google Meet
         meeting_details = {
-            "notes": data.get('description', 'Scheduled meeting'),
-            "platform": "Google Meet" if not data.get('location') else "In-person",
+            "notes": description,
+            "platform": "Google Meet" if not payload.location else "In-person",
             # "meeting_id": f"drew_meeting_{hash(str(datetime.utcnow()))}",
             "meeting_link": None,  # Will be updated if a Google Meet is created
-            "location": data.get('location')
+            "location": payload.location
         }
 
-        def background_booking_process():
-            db_bg = SessionLocal()
+        # Record the appointment before answering, so the 202 reflects committed
+        # state. The Meet event and invitation are handled by the queue worker
+        # (worker.py), which survives API restarts and retries transient errors.
+        (communication_id, appointment_id), = bulk_book(db, [{
+            "user_id": payload.user_id,
+            "lead_id": lead.id,
+            "lead_name": lead.name,
+            "appointment_time": start_time,
+            "meeting_details": meeting_details
+        }])
+        if meeting_details["platform"] == "Google Meet":
             try:
-                # 1. Create communication and appointment records.
-                communication = DrewLeadCommunication(
-                    user_id=data['user_id'],
-                    lead_id=lead.id,
-                    drew_id="agent_drew",
-                    type="MEETING",
-                    status="SCHEDULED",
-                    details=meeting_details
-                )
-                appointment = Appointment(
-                    user_id=data['user_id'],
-                    appointment_time=start_time,
-                    status="scheduled",
-                    participant_details={
-                        "lead": {
-                            "id": lead.id,
-                            "name": lead.name,
-                            "meeting_details": meeting_details,
-                            "duration": 3600
-                        }
+                anyio.from_thread.run(partial(
+                    enqueue_job,
+                    "book_appointment_job",
+                    appointment_id,
+                    payload.user_id,
+                    lead.id,
+                    start_time.isoformat(),
+                    meeting_details,
+                    payload.meeting_type,
+                    payload.description or "",
+                    payload.location,
+                    _job_id=f"book_appointment:{appointment_id}"
+                ))
+            except Exception as e:
+                # Without a job nothing would create the event or send the
+                # invitation, so take both booking rows back out; a retry then
+                # starts clean instead of recording a duplicate.
+                logger.exception("book_appointment: could not queue appointment %s: %s", appointment_id, e)
+                db.execute(delete(DrewLeadCommunication).where(DrewLeadCommunication.id == communication_id))
+                db.execute(delete(Appointment).where(Appointment.id == appointment_id))
+                db.commit()
+                return JSONResponse(
+                    status_code=503,
+                    content={
+                        "status": "error",
+                        "message": "The appointment could not be scheduled right now.",
+                        "context_for_llm": (
+                            "Scheduling is temporarily unavailable and no appointment was booked. "
+                            "Please try again in a moment."
+                        ),
+                        "error_details": str(e)
                     }
                 )
-                db_bg.add(communication)
-                db_bg.add(appointment)
-                db_bg.commit()
-
-                # 2. Retrieve the Google integration credentials.
-                email_integration = db_bg.query(Integration).filter_by(
-                    user_id=data['user_id'],
-                    platform_name='google_calendar'
-                ).first()
-
-                # 3. If this is a Google Meet appointment, create a calendar event.
-                if meeting_details["platform"] == "Google Meet":
-                    credentials = get_user_credentials(data['user_id'])
-                    if credentials:
-                        credentials = refresh_and_save_credentials(data['user_id'], credentials)
-                        service = build('calendar', 'v3', credentials=credentials)
-                        event_body = {
-                            'summary': f"Meeting with {lead.name}",
-                            'description': meeting_details["notes"],
-                            'start': {'dateTime': start_time.isoformat(), 'timeZone': 'UTC'},
-                            'end': {'dateTime': end_time.isoformat(), 'timeZone': 'UTC'},
-                            'conferenceData': {
-                                'createRequest': {
-                                    'requestId': str(datetime.utcnow().timestamp()),
-                                    'conferenceSolutionKey': {'type': 'hangoutsMeet'}
-                                }
-                            }
-                        }
-                        event = service.events().insert(
-                            calendarId='primary',
-                            body=event_body,
-                            conferenceDataVersion=1
-                        ).execute()
-                        meeting_details["meeting_link"] = event.get("hangoutLink")
-                        print("Created Google Meet event with link:", meeting_details["meeting_link"])
-
-                        # 4. Retrieve the user (for brokerage details)
-                        user = db_bg.query(User).get(data['user_id'])
-                        # Ensure that the user object has a 'brokerage_name' attribute.
-
-                        # 5. Call OpenAI to generate a custom email invitation.
-                        meeting_type = data.get("meeting_type", "follow-up")
-                        drafted_email = draft_email_via_ai(
-                            user=user,
-                            meeting_type=meeting_type,
-                            meeting_details=meeting_details,
-                            meeting_time=start_time,
-                            additional_description=data.get("description", "")
-                        )
-                        print("Drafted email from OpenAI:", drafted_email)
-
-                        # 6. Build event details for the email notification.
-                        event_details = {
-                            "summary": f"Meeting with {lead.name}",
-                            "start_time": start_time.isoformat(),
-                            "end_time": end_time.isoformat(),
-                            # Use the AI-drafted email body.
-                            "description": drafted_email.get("body", meeting_details["notes"]),
-                            "location": data.get('location', 'Google Meet'),
-                            "html_link": meeting_details.get("meeting_link", "")
-                        }
-
-                        # 7. Determine the sender email from the integration credentials.
-                        sender_email = (
-                            email_integration.credentials.get('email')
-                            if email_integration and email_integration.credentials.get('email')
-                            else 'noreply@example.com'
-                        )
-
-                        # 8. Send the drafted email via the Gmail API.
-                        send_success = send_email_notification(
-                            credentials=credentials,
-                            sender_email=sender_email,
-                            recipient_email=lead.email,
-                            event_details=event_details
-                        )
-                        if send_success:
-                            print("Email notification sent successfully.")
-                        else:
-                            print("Failed to send email notification.")
-                else:
-                    # For in-person meetings, add additional notification logic if needed.
-                    pass
-
-            except Exception as e:
-                db_bg.rollback()
-                print(f"Error in background booking process: {e}")
-            finally:
-                db_bg.close()
-
-        background_tasks.add_task(background_booking_process)
+        # For in-person meetings, add additional notification logic if needed.
 
         return JSONResponse(
             status_code=202,
@@ -434,7 +598,7 @@ async def book_appointment(request: Request, background_tasks: BackgroundTasks,
                 "context_for_llm": (
                     f"I've found the lead '{lead.name}' and started scheduling an appointment for "
                     f"{start_time.strftime('%B %d, %Y at %I:%M %p')}. The appointment will be "
-                    f"{'in-person' if data.get('location') else 'via Google Meet'}. Please check your dashboard for notifications."
+                    f"{'in-person' if payload.location else 'via Google Meet'}. Please check your dashboard for notifications."
                 ),
                 "lead_details": {
                     "lead_id": lead.id,
@@ -445,23 +609,13 @@ async def book_appointment(request: Request, background_tasks: BackgroundTasks,
                 "appointment_details": {
                     "start_time": start_time.isoformat(),
                     "end_time": end_time.isoformat(),
-                    "location": data.get('location', 'Google Meet'),
-                    "description": data.get('description', 'Scheduled meeting')
+                    "location": payload.location or 'Google Meet',
+                    "description": description
                 }
             }
         )
-    except ValueError as e:
-        raise HTTPException(
-            status_code=400,
-            detail={
-                "status": "error",
-                "message": "Invalid date/time format",
-                "context_for_llm": f"There was an error processing the appointment time: {e}. Please ensure the time is in ISO format (YYYY-MM-DDTHH:MM:SS).",
-                "error_details": str(e)
-            }
-        )
     except Exception as e:
-        print(f"Error in book_appointment: {e}")
+        logger.exception("Error in book_appointment: %s", e)
         raise HTTPException(
             status_code=500,
             detail={
@@ -476,58 +630,55 @@ async def book_appointment(request: Request, background_tasks: BackgroundTasks,
 @router.get("/get_available_times/{user_id}")
 async def get_available_times(user_id: int):
     try:
-        credentials = get_user_credentials(user_id)
+        credentials = await asyncio.to_thread(get_user_credentials, user_id)
         if not credentials:
             raise HTTPException(
                 status_code=401,
                 detail={"error": "Google Calendar integration not found", "user_id": user_id}
             )
 
-        credentials = refresh_and_save_credentials(user_id, credentials)
+        credentials = await asyncio.to_thread(refresh_and_save_credentials, user_id, credentials)
         if not credentials:
             raise HTTPException(
                 status_code=401,
                 detail={"error": "Failed to refresh credentials", "user_id": user_id}
             )
 
-        service = build('calendar', 'v3', credentials=credentials)
-        events = []
-        page_token = None
-        while True:
-            events_result = service.events().list(
-                calendarId='primary',
-                pageToken=page_token,
-                singleEvents=True,
-                orderBy='startTime',
-                maxResults=2500
-            ).execute()
-            events.extend(events_result.get('items', []))
-            page_token = events_result.get('nextPageToken')
-            if not page_token:
-                break
-
-        busy_times = []
-        for event in events:
-            start = event['start'].get('dateTime') or event['start'].get('date')
-            end = event['end'].get('dateTime') or event['end'].get('date')
-            if start and end:
-                busy_slot = {
-                    'start': start,
-                    'end': end,
-                    'summary': event.get('summary', 'Busy'),
-                    'id': event.get('id'),
-                    'status': event.get('status'),
-                    'organizer': event.get('organizer', {}).get('email'),
-                    'created': event.get('created'),
-                    'updated': event.get('updated'),
-                    'attendees_count': len(event.get('attendees', [])),
-                    'description': event.get('description', '')
-                }
-                busy_times.append(busy_slot)
+        now = datetime.utcnow()
+        time_min = now.isoformat() + 'Z'
+        time_max = (now + timedelta(days=30)).isoformat() + 'Z'
+
+        # freebusy returns just the merged busy intervals, however many events
+        # the calendar holds; it and the timezone lookup share one batch request.
+        def fetch_busy_times():
+            service = build_service('calendar', 'v3', credentials)
+            responses = {}
+
+            def collect(request_id, response, exception):
+                responses[request_id] = exception if exception is not None else response
+
+            batch = service.new_batch_http_request(callback=collect)
+            batch.add(service.freebusy().query(body={
+                'timeMin': time_min,
+                'timeMax': time_max,
+                'timeZone': 'UTC',
+                'items': [{'id': 'primary'}]
+            }), request_id='freebusy')
+            batch.add(service.calendars().get(calendarId='primary', fields='timeZone'),
+                      request_id='calendar')
+            batch.execute()
+            for response in responses.values():
+                if isinstance(response, Exception):
+                    raise response
+            return responses['freebusy'], responses['calendar']
+
+        freebusy, calendar_data = await asyncio.to_thread(fetch_busy_times)
+        busy_times = [
+            {'start': slot['start'], 'end': slot['end']}
+            for slot in freebusy['calendars']['primary'].get('busy', [])
+        ]
 
-        calendar_data = service.calendars().get(calendarId='primary').execute()
         timezone = calendar_data.get('timeZone', 'UTC')
-        busy_times.sort(key=lambda x: x['start'])
 
         response_data = {
             'busy_times': busy_times,
@@ -538,13 +689,11 @@ async def get_available_times(user_id: int):
             },
             'calendar_id': 'primary',
             'timezone': timezone,
-            'total_events': len(events)
+            'total_events': len(busy_times)
         }
         return response_data
     except Exception as e:
-        import traceback
-        print(f"Error in get_available_times: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+        logger.exception("Error in get_available_times: %s", e)
         raise HTTPException(
             status_code=500,
             detail={"error": "Failed to fetch calendar events", "details": str(e)}
@@ -552,9 +701,8 @@ async def get_available_times(user_id: int):
 
 
 @router.post("/save_communication")
-async def save_communication(request: Request, db: Session = Depends(get_db)):
+def save_communication(data: Dict[Any, Any], db: Session = Depends(get_db)):
     try:
-        data = await request.json()
         required_fields = ['user_id', 'type', 'status', 'details']
         if not all(field in data for field in required_fields):
             raise HTTPException(
@@ -562,8 +710,8 @@ async def save_communication(request: Request, db: Session = Depends(get_db)):
                 detail={"error": "Missing required fields", "required_fields": required_fields}
             )
 
-        user = db.query(User).get(data['user_id'])
-        if not user:
+        # Existence check only: fetch the key, not the whole user row.
+        if db.scalar(select(User.id).where(User.id == data['user_id'])) is None:
             raise HTTPException(status_code=404, detail="User not found")
 
         if data.get('lead_id') and data.get('drew_id'):
@@ -603,7 +751,7 @@ async def save_communication(request: Request, db: Session = Depends(get_db)):
                     detail="Duration and call_id are required for call records"
                 )
             call_time = (
-                datetime.fromisoformat(data.get('call_time', '').replace('Z', '+00:00'))
+                ciso8601.parse_datetime(data['call_time'])
                 if data.get('call_time')
                 else datetime.utcnow()
             )
@@ -619,6 +767,7 @@ async def save_communication(request: Request, db: Session = Depends(get_db)):
             call_id = call.id
 
         db.commit()
+        invalidate_dashboard(data['user_id'])
         response = {"status": "success", "communication_id": communication.id}
         if call_id is not None:
             response["call_id"] = call_id
@@ -631,115 +780,194 @@ async def save_communication(request: Request, db: Session = Depends(get_db)):
         )
 
 
-from sqlalchemy.orm import joinedload  # <-- Add this import at the top
+# Serialized dashboard payloads keyed by (user_id, start_date, end_date). Repeated refreshes
+# within the TTL are served from memory; writes through save_communication
+# drop the user's entries, other writes show up once the entry expires.
+_dashboard_cache = TTLCache(maxsize=2_000, ttl=30)
+_dashboard_cache_lock = threading.RLock()
+
+
+def invalidate_dashboard(user_id):
+    user_id = int(user_id)
+    with _dashboard_cache_lock:
+        for key in [key for key in _dashboard_cache if key[0] == user_id]:
+            _dashboard_cache.pop(key, None)
+
 
 @router.get("/get_user_communications/{user_id}")
-async def get_user_communications(user_id: int, start_date: str = None, end_date: str = None,
-                                  db: Session = Depends(get_db)):
+def get_user_communications(user_id: int, start_date: str = None, end_date: str = None,
+                            db: Session = Depends(get_db)):
+    cache_key = (user_id, start_date, end_date)
+    with _dashboard_cache_lock:
+        cached = _dashboard_cache.get(cache_key)
+    if cached is not None:
+        return orjson_response(cached)
     try:
+        # Every relative cutoff is measured from the same instant.
+        now = datetime.utcnow()
         start = datetime.fromisoformat(start_date.replace('Z', '+00:00')) if start_date else None
         end = datetime.fromisoformat(end_date.replace('Z', '+00:00')) if end_date else None
 
-        user = db.query(User).get(user_id)
-        if not user:
+        if db.scalar(select(User.id).where(User.id == user_id)) is None:
             raise HTTPException(status_code=404, detail={'status': 'error', 'message': 'User not found'})
 
-        calls_query = db.query(Call).filter_by(user_id=user_id)
-        leads_query = db.query(Lead).filter_by(user_id=user_id)
-        dlc_query = db.query(DrewLeadCommunication).filter_by(user_id=user_id)
-        ulc_query = db.query(UserLeadCommunication).filter_by(user_id=user_id)
-        appointments_query = db.query(Appointment).filter_by(user_id=user_id)
+        call_filters = [Call.user_id == user_id]
+        lead_filters = [Lead.user_id == user_id]
+        dlc_filters = [DrewLeadCommunication.user_id == user_id]
+        ulc_filters = [UserLeadCommunication.user_id == user_id]
+        appointment_filters = [Appointment.user_id == user_id]
 
         if start:
-            calls_query = calls_query.filter(Call.created_at >= start)
-            leads_query = leads_query.filter(Lead.created_at >= start)
-            dlc_query = dlc_query.filter(DrewLeadCommunication.created_at >= start)
-            ulc_query = ulc_query.filter(UserLeadCommunication.created_at >= start)
-            appointments_query = appointments_query.filter(Appointment.appointment_time >= start)
+            call_filters.append(Call.created_at >= start)
+            lead_filters.append(Lead.created_at >= start)
+            dlc_filters.append(DrewLeadCommunication.created_at >= start)
+            ulc_filters.append(UserLeadCommunication.created_at >= start)
+            appointment_filters.append(Appointment.appointment_time >= start)
         if end:
-            calls_query = calls_query.filter(Call.created_at <= end)
-            leads_query = leads_query.filter(Lead.created_at <= end)
-            dlc_query = dlc_query.filter(DrewLeadCommunication.created_at <= end)
-            ulc_query = ulc_query.filter(UserLeadCommunication.created_at <= end)
-            appointments_query = appointments_query.filter(Appointment.appointment_time <= end)
-
-        avg_duration = db.query(func.avg(Call.duration)).filter(calls_query.whereclause).scalar() or 0
+            call_filters.append(Call.created_at <= end)
+            lead_filters.append(Lead.created_at <= end)
+            dlc_filters.append(DrewLeadCommunication.created_at <= end)
+            ulc_filters.append(UserLeadCommunication.created_at <= end)
+            appointment_filters.append(Appointment.appointment_time <= end)
+
+        # One grouped pass per table; totals and the overall average are
+        # pivoted out of the per-status rows instead of re-querying.
+        call_rows = db.execute(
+            select(Call.status, func.count(), func.count(Call.duration), func.sum(Call.duration))
+            .where(*call_filters)
+            .group_by(Call.status)
+        ).all()
+        call_counts = {status: count for status, count, _, _ in call_rows}
+        timed_calls = sum(timed for _, _, timed, _ in call_rows)
+        total_duration = sum(duration or 0 for _, _, _, duration in call_rows)
         call_metrics = {
-            'total_calls': calls_query.count(),
+            'total_calls': sum(call_counts.values()),
             'calls_by_status': {
-                'successful': calls_query.filter_by(status='successful').count(),
-                'missed': calls_query.filter_by(status='missed').count()
+                'successful': call_counts.get('successful', 0),
+                'missed': call_counts.get('missed', 0)
             },
-            'average_duration': round(float(avg_duration), 2)
+            'average_duration': round(float(total_duration) / timed_calls, 2) if timed_calls else 0.0
         }
 
-        total_leads = leads_query.count()
-        leads_by_status = {status: leads_query.filter_by(status=status).count() for status in
+        # The actionable lead counts ride along as conditional aggregates.
+        lead_rows = db.execute(
+            select(
+                Lead.status,
+                func.count(),
+                func.count(case((Lead.created_at >= now - timedelta(days=30), 1))),
+                func.count(case((and_(
+                    Lead.status.in_(['new', 'contacted']),
+                    Lead.created_at <= now - timedelta(days=7)
+                ), 1)))
+            ).where(*lead_filters).group_by(Lead.status)
+        ).all()
+        lead_counts = {status: count for status, count, _, _ in lead_rows}
+        total_leads = sum(lead_counts.values())
+        leads_by_status = {status: lead_counts.get(status, 0) for status in
                            ['new', 'contacted', 'qualified', 'closed']}
 
-        all_lead_communications = (
-            dlc_query.options(joinedload(DrewLeadCommunication.lead)).all() +
-            ulc_query.options(joinedload(UserLeadCommunication.lead)).all()
-        )
-        all_lead_communications.sort(key=lambda x: x.created_at, reverse=True)
+        # Latest five across both tables in one statement: each side is a
+        # five-row index scan, merged and joined to its leads by the database.
+        latest_per_table = union_all(*(
+            select(
+                select(comm_model.lead_id, comm_model.type, comm_model.status,
+                       comm_model.created_at, comm_model.details,
+                       literal(comm_model.__name__).label('communication_type'))
+                .where(*filters)
+                .order_by(comm_model.created_at.desc())
+                .limit(5)
+                .subquery()
+            )
+            for comm_model, filters in ((DrewLeadCommunication, dlc_filters),
+                                        (UserLeadCommunication, ulc_filters))
+        )).subquery()
+        latest_comms = db.execute(
+            select(latest_per_table, Lead.name.label('lead_name'), Lead.email.label('lead_email'))
+            .outerjoin(Lead, Lead.id == latest_per_table.c.lead_id)
+            .order_by(latest_per_table.c.created_at.desc())
+            .limit(5)
+        ).all()
         latest_interactions = [{
             'lead_id': comm.lead_id,
-            'lead_name': comm.lead.name if comm.lead else 'Unknown',
-            'lead_email': comm.lead.email if comm.lead else None,
+            'lead_name': comm.lead_name if comm.lead_name is not None else 'Unknown',
+            'lead_email': comm.lead_email,
             'type': comm.type,
             'status': comm.status,
-            'created_at': comm.created_at.isoformat(),
+            'created_at': comm.created_at,
             'details': comm.details,
-            'communication_type': type(comm).__name__
-        } for comm in all_lead_communications[:5]]
+            'communication_type': comm.communication_type
+        } for comm in latest_comms]
+
+        # Per-lead counts are aggregated in the database and the winner is
+        # joined to its lead; the window sum carries the overall communication
+        # total on the same row.
+        lead_comms = union_all(
+            select(DrewLeadCommunication.lead_id).where(*dlc_filters),
+            select(UserLeadCommunication.lead_id).where(*ulc_filters)
+        ).subquery()
+        lead_comm_counts = (
+            select(lead_comms.c.lead_id,
+                   func.count().label('interaction_count'),
+                   func.sum(func.count()).over().label('total_communications'))
+            .group_by(lead_comms.c.lead_id)
+            .subquery()
+        )
+        top_lead = db.execute(
+            select(lead_comm_counts, Lead.id, Lead.name, Lead.email, Lead.status, Lead.created_at)
+            .outerjoin(Lead, Lead.id == lead_comm_counts.c.lead_id)
+            .order_by(lead_comm_counts.c.interaction_count.desc())
+            .limit(1)
+        ).first()
+        total_lead_communications = int(top_lead.total_communications) if top_lead else 0
 
-        lead_interaction_counts = {}
-        for comm in all_lead_communications:
-            lead_interaction_counts[comm.lead_id] = lead_interaction_counts.get(comm.lead_id, 0) + 1
-        most_active_lead_id = max(lead_interaction_counts.items(), key=lambda x: x[1])[0] if lead_interaction_counts else None
         most_active_lead = None
-        if most_active_lead_id:
-            lead_obj = db.query(Lead).get(most_active_lead_id)
-            if lead_obj:
-                most_active_lead = {
-                    'id': lead_obj.id,
-                    'name': lead_obj.name,
-                    'email': lead_obj.email,
-                    'status': lead_obj.status,
-                    'interaction_count': lead_interaction_counts[most_active_lead_id],
-                    'created_at': lead_obj.created_at.isoformat()
-                }
+        if top_lead and top_lead.id:
+            most_active_lead = {
+                'id': top_lead.id,
+                'name': top_lead.name,
+                'email': top_lead.email,
+                'status': top_lead.status,
+                'interaction_count': top_lead.interaction_count,
+                'created_at': top_lead.created_at
+            }
 
-        recent_appointments = appointments_query.order_by(Appointment.appointment_time.desc()).limit(5).all()
+        # The window count is taken over every matching appointment before the
+        # LIMIT applies, so the upcoming total comes back with the recent rows.
+        recent_appointments = db.execute(
+            select(
+                Appointment,
+                func.count(case((and_(
+                    Appointment.appointment_time >= now,
+                    Appointment.status == 'scheduled'
+                ), 1))).over()
+            )
+            .where(*appointment_filters)
+            .order_by(Appointment.appointment_time.desc())
+            .limit(5)
+        ).all()
+        upcoming_appointments = recent_appointments[0][1] if recent_appointments else 0
         appointments_data = [{
             'id': apt.id,
-            'appointment_time': apt.appointment_time.isoformat(),
+            'appointment_time': apt.appointment_time,
             'status': apt.status,
             'participant_details': apt.participant_details,
-            'created_at': apt.created_at.isoformat()
-        } for apt in recent_appointments]
+            'created_at': apt.created_at
+        } for apt, _ in recent_appointments]
 
-        recent_period = datetime.utcnow() - timedelta(days=30)
         actionable_metrics = {
-            'new_leads_last_30_days': leads_query.filter(Lead.created_at >= recent_period).count(),
+            'new_leads_last_30_days': sum(new for _, _, new, _ in lead_rows),
             'successful_calls_rate': round(
                 (call_metrics['calls_by_status']['successful'] / call_metrics['total_calls'] * 100)
                 if call_metrics['total_calls'] > 0 else 0, 2
             ),
             'average_interactions_per_lead': round(
-                len(all_lead_communications) / total_leads if total_leads > 0 else 0, 2
+                total_lead_communications / total_leads if total_leads > 0 else 0, 2
             ),
-            'leads_needing_followup': leads_query.filter(
-                Lead.status.in_(['new', 'contacted']),
-                Lead.created_at <= datetime.utcnow() - timedelta(days=7)
-            ).count(),
-            'upcoming_appointments': appointments_query.filter(
-                Appointment.appointment_time >= datetime.utcnow(),
-                Appointment.status == 'scheduled'
-            ).count()
+            'leads_needing_followup': sum(followup for _, _, _, followup in lead_rows),
+            'upcoming_appointments': upcoming_appointments
         }
 
-        return {
+        dashboard = {
             'status': 'success',
             'metrics': {
                 'call_metrics': call_metrics,
@@ -760,46 +988,73 @@ async def get_user_communications(user_id: int, start_date: str = None, end_date
                 'end_date': end_date
             }
         }
+        # Cached serialized, so a hit skips re-encoding the payload.
+        body = orjson.dumps(dashboard)
+        with _dashboard_cache_lock:
+            _dashboard_cache[cache_key] = body
+        return orjson_response(body)
     except Exception as e:
-        print(f"Error in get_user_communications: {str(e)}")
+        logger.exception("Error in get_user_communications: %s", e)
         raise HTTPException(status_code=500, detail={'status': 'error', 'message': str(e)})
 
 
 
+def _format_call(communicator, date_str, details):
+    return f"[{communicator} Call on {date_str}] {details.get('notes', 'No notes available')}"
+
+
+def _format_email(communicator, date_str, details):
+    return (
+        f"[{communicator} Email sent on {date_str}]\n"
+        f"Subject: {details.get('subject', 'No subject')}\n"
+        f"Content: {details.get('body', 'No content')}"
+    )
+
+
+def _format_sms(communicator, date_str, details):
+    return f"[{communicator} SMS on {date_str}] {details.get('message', 'No message content')}"
+
+
+# Interaction history line per communication type; other types are left out.
+INTERACTION_FORMATTERS = {
+    "CALL": _format_call,
+    "EMAIL": _format_email,
+    "SMS": _format_sms
+}
+
+
 @router.get("/get_lead_interactions/{lead_id}")
-async def get_lead_interactions(lead_id: int, db: Session = Depends(get_db)):
+def get_lead_interactions(lead_id: int, db: Session = Depends(get_db)):
     try:
-        drew_lead_comms = db.query(DrewLeadCommunication).filter_by(
-            lead_id=lead_id
-        ).order_by(DrewLeadCommunication.created_at.asc()).all()
-        user_lead_comms = db.query(UserLeadCommunication).filter_by(
-            lead_id=lead_id
-        ).order_by(UserLeadCommunication.created_at.asc()).all()
-
-        all_communications = sorted(
-            drew_lead_comms + user_lead_comms,
-            key=lambda x: x.created_at
-        )
-
-        interactions = []
-        for comm in all_communications:
-            date_str = comm.created_at.strftime("%B %d, %Y at %I:%M %p")
-            communicator = "Drew" if isinstance(comm, DrewLeadCommunication) else "Agent"
-            if comm.type == "CALL":
-                notes = comm.details.get('notes', 'No notes available')
-                interactions.append(f"[{communicator} Call on {date_str}] {notes}")
-            elif comm.type == "EMAIL":
-                subject = comm.details.get('subject', 'No subject')
-                body = comm.details.get('body', 'No content')
-                interactions.append(f"[{communicator} Email sent on {date_str}]\nSubject: {subject}\nContent: {body}")
-            elif comm.type == "SMS":
-                message = comm.details.get('message', 'No message content')
-                interactions.append(f"[{communicator} SMS on {date_str}] {message}")
-
-        lead = db.query(Lead).get(lead_id)
+        # Check the lead first so a missing lead costs a single query.
+        lead = db.query(
+            Lead.name, Lead.email, Lead.phone, Lead.status, Lead.source, Lead.lead_details
+        ).filter(Lead.id == lead_id).first()
         if not lead:
             raise HTTPException(status_code=404, detail="Lead not found")
 
+        # Both communication tables in one statement, already in time order.
+        all_communications = db.execute(
+            union_all(*(
+                select(comm_model.type, comm_model.details, comm_model.created_at,
+                       literal(communicator).label('communicator'))
+                .where(comm_model.lead_id == lead_id)
+                for comm_model, communicator in ((DrewLeadCommunication, "Drew"),
+                                                 (UserLeadCommunication, "Agent"))
+            )).order_by('created_at')
+        ).all()
+
+        # The union's literal tag says which side each row came from.
+        tally = Counter(comm.communicator for comm in all_communications)
+        interaction_counts = {"drew": tally["Drew"], "agent": tally["Agent"]}
+        interactions = [
+            INTERACTION_FORMATTERS[comm.type](
+                comm.communicator, comm.created_at.strftime("%B %d, %Y at %I:%M %p"), comm.details
+            )
+            for comm in all_communications
+            if comm.type in INTERACTION_FORMATTERS
+        ]
+
         context = {
             "lead_info": {
                 "name": lead.name,
@@ -811,21 +1066,20 @@ async def get_lead_interactions(lead_id: int, db: Session = Depends(get_db)):
             },
             "interaction_history": interactions,
             "total_interactions": len(interactions),
-            "interaction_counts": {
-                "drew": len(drew_lead_comms),
-                "agent": len(user_lead_comms)
-            }
+            "interaction_counts": interaction_counts
         }
         return context
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail={"error": str(e)})
 
 
 @router.post("/search_leads")
-async def search_leads(request: Request, db: Session = Depends(get_db)):
+def search_leads(data: Dict[Any, Any], db: Session = Depends(get_db)):
     try:
-        data = await request.json()
-        print(f"Initial request data: {data}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Initial request data: %s", data)
         if not data:
             raise HTTPException(status_code=400, detail={"error": "No JSON data provided"})
 
@@ -836,6 +1090,11 @@ async def search_leads(request: Request, db: Session = Depends(get_db)):
                 status_code=400,
                 detail={"error": "Missing required fields: 'user_id' and 'search_term' must be provided."}
             )
+        if len(str(search_term).strip()) < MIN_SEARCH_TERM_LENGTH:
+            raise HTTPException(
+                status_code=400,
+                detail={"error": f"search_term must be at least {MIN_SEARCH_TERM_LENGTH} characters long."}
+            )
 
         try:
             user_id = int(user_id)
@@ -847,7 +1106,7 @@ async def search_leads(request: Request, db: Session = Depends(get_db)):
 
         matching_leads = db.query(Lead).filter(
             Lead.user_id == user_id,
-            Lead.name.ilike(f"%{search_term}%")
+            lead_name_matches(search_term)
         ).all()
 
         leads_list = []
@@ -860,21 +1119,24 @@ async def search_leads(request: Request, db: Session = Depends(get_db)):
                 "phone": lead.phone,
                 "external_id": lead.external_id,
                 "source": lead.source,
-                "created_at": lead.created_at.isoformat() if lead.created_at else None,
-                "updated_at": lead.updated_at.isoformat() if lead.updated_at else None,
+                "created_at": lead.created_at,
+                "updated_at": lead.updated_at,
                 "lead_details": lead.lead_details
             }
             leads_list.append(lead_data)
 
-        print(f"Lead list: {leads_list}")
-        return JSONResponse(status_code=200, content=leads_list)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Lead list: %s", leads_list)
+        return orjson_response(leads_list)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in /search_leads: {str(e)}")
+        logger.exception("Error in /search_leads: %s", e)
         raise HTTPException(status_code=500, detail={"error": str(e)})
 
 
 @router.post("/initiate_call")
-async def initiate_call(
+def initiate_call(
         data: Dict[Any, Any],
         background_tasks: BackgroundTasks,
         db: Session = Depends(get_db)
@@ -904,10 +1166,7 @@ async def initiate_call(
             )
 
         # Search for contacts (leads) matching the provided contact_name
-        matching_contacts = db.query(Lead).filter(
-            Lead.user_id == data['user_id'],
-            Lead.name.ilike(f"%{data['contact_name']}%")
-        ).all()
+        matching_contacts = find_matching_leads(db, data['user_id'], data['contact_name'])
 
         # Case 1: No contacts found
         if not matching_contacts:
@@ -926,14 +1185,7 @@ async def initiate_call(
 
         # Case 2: Multiple contacts found
         if len(matching_contacts) > 1:
-            contacts_info = [{
-                "contact_id": contact.id,
-                "name": contact.name,
-                "email": contact.email,
-                "phone": contact.phone,
-                "status": contact.status,
-                "source": contact.source
-            } for contact in matching_contacts]
+            contacts_info = match_list(ContactMatch, matching_contacts)
 
             return JSONResponse(
                 status_code=300,
@@ -954,7 +1206,7 @@ async def initiate_call(
 
         # Parse and validate call_time
         try:
-            call_time = datetime.fromisoformat(data['call_time'].replace('Z', '+00:00'))
+            call_time = ciso8601.parse_datetime(data['call_time'])
         except Exception as e:
             return JSONResponse(
                 status_code=400,
@@ -970,12 +1222,18 @@ async def initiate_call(
             )
 
         # Define background task for call processing
-        def background_call_process(db: Session):
+        async def background_call_process():
+            # Blocking DB calls run in worker threads; the webhook goes out on
+            # the shared async HTTP client. The session belongs to this task and
+            # is opened only once it runs.
+            db = SessionLocal()
             try:
                 # Check if any previous Drew–Lead communication exists for this lead.
-                existing_comm = db.query(DrewLeadCommunication).filter(
-                    DrewLeadCommunication.lead_id == contact.id
-                ).first()
+                existing_comm = await asyncio.to_thread(
+                    db.query(DrewLeadCommunication).filter(
+                        DrewLeadCommunication.lead_id == contact.id
+                    ).first
+                )
                 first_interaction = "true" if existing_comm is None else "false"
 
                 # Prepare the details for the communication record (if you still want to store them)
@@ -996,7 +1254,7 @@ async def initiate_call(
                 db.add(communication)
 
                 # Create a Call record
-                generated_call_id = f"call_{int(datetime.utcnow().timestamp())}"
+                generated_call_id = f"call_{secrets.token_hex(8)}"
                 call_record = Call(
                     user_id=data['user_id'],
                     call_time=call_time,
@@ -1006,10 +1264,13 @@ async def initiate_call(
                 )
                 db.add(call_record)
 
-                db.commit()
+                await asyncio.to_thread(db.commit)
 
-                # Retrieve the user record for additional details (like bot and brokerage name)
-                user_record = db.query(User).get(data['user_id'])
+                # Retrieve the user's bot and brokerage details for the webhook payload
+                user_record = await asyncio.to_thread(
+                    db.query(User.drew_voice_accent, User.drew_name, User.brokerage_name)
+                    .filter(User.id == data['user_id']).first
+                )
                 override_agent_id = "agent_6467d8b24bd7e6990475ef462b"  # Default value
                 if user_record.drew_voice_accent:
                     override_agent_id = user_record.drew_voice_accent.get("outbound_drew_id", override_agent_id)
@@ -1018,7 +1279,7 @@ async def initiate_call(
                 webhook_url = "https://services.leadconnectorhq.com/hooks/jyPDXTf3YpjI9G74bRCW/webhook-trigger/46adfe70-c715-405a-9421-ba07be3d2434"
                 webhook_headers = {
                     "Content-Type": "application/json",
-                    "Authorization": f"Bearer {os.getenv('GHL_KEY')}"
+                    "Authorization": f"Bearer {get_settings().ghl_key}"
                 }
                 payload = {
                     "inbound_dynamic_variables_webhook_url": "https://hook.us2.make.com/5udlpktf98lfq8my2ke6xq8ppiho4x8j",
@@ -1038,20 +1299,21 @@ async def initiate_call(
                         "first_interaction": first_interaction
                     }
                 }
-                response = requests.post(webhook_url, headers=webhook_headers, json=payload)
-                print("Webhook response status:", response.status_code, response.text)
+                response = await get_http_client().post(webhook_url, headers=webhook_headers, json=payload)
+                logger.info("Call webhook response: %s %s", response.status_code, response.text)
 
             except Exception as e:
-                db.rollback()
-                print(f"Error in background call process: {str(e)}")
+                await asyncio.to_thread(db.rollback)
+                logger.exception("Error in background call process: %s", e)
             finally:
-                db.close()
+                await asyncio.to_thread(db.close)
 
-        # Add background task (using a new SessionLocal instance)
-        background_tasks.add_task(background_call_process, SessionLocal())
+        background_tasks.add_task(background_call_process)
 
         # Prepare the immediate response
-        now = datetime.now()
+        # Match the parsed time's awareness; a 'Z' or offset suffix gives an
+        # aware datetime that cannot be compared with a naive one.
+        now = datetime.now(call_time.tzinfo)
         if call_time <= now:
             response_message = f"I'm calling {contact.name} now."
         else:
@@ -1084,7 +1346,7 @@ async def initiate_call(
         )
 
     except Exception as e:
-        print(f"Error in initiate_call: {str(e)}")
+        logger.exception("Error in initiate_call: %s", e)
         raise HTTPException(
             status_code=500,
             detail={
@@ -1101,7 +1363,7 @@ async def initiate_call(
 
 
 @router.post("/send_message")
-async def send_message(
+def send_message(
         data: Dict[Any, Any],
         background_tasks: BackgroundTasks,
         db: Session = Depends(get_db)
@@ -1141,10 +1403,7 @@ async def send_message(
             )
 
         # Search for leads
-        matching_leads = db.query(Lead).filter(
-            Lead.user_id == data['user_id'],
-            Lead.name.ilike(f"%{data['lead_name']}%")
-        ).all()
+        matching_leads = find_matching_leads(db, data['user_id'], data['lead_name'])
 
         # Case 1: No leads found
         if not matching_leads:
@@ -1160,14 +1419,7 @@ async def send_message(
 
         # Case 2: Multiple leads found
         if len(matching_leads) > 1:
-            leads_info = [{
-                "lead_id": lead.id,
-                "name": lead.name,
-                "email": lead.email,
-                "phone": lead.phone,
-                "status": lead.status,
-                "source": lead.source
-            } for lead in matching_leads]
+            leads_info = match_list(LeadMatch, matching_leads)
             return JSONResponse(
                 status_code=300,
                 content={
@@ -1183,13 +1435,19 @@ async def send_message(
         lead = matching_leads[0]
 
         # Define background task for message processing
-        def background_message_process(db: Session):
+        async def background_message_process():
+            # Blocking DB and Gmail calls run in worker threads so the event
+            # loop stays free while this task waits on them; webhooks go out
+            # on the shared async HTTP client. The session belongs to this task
+            # and is opened only once it runs.
+            db = SessionLocal()
             try:
+                sent_at = datetime.utcnow()
                 # Create a communication record for the message
                 message_details = {
                     "message_content": data['message_content'],
                     "message_type": data['message_type'].upper(),
-                    "timestamp": datetime.utcnow().isoformat()
+                    "timestamp": sent_at.isoformat()
                 }
                 communication = DrewLeadCommunication(
                     user_id=data['user_id'],
@@ -1200,18 +1458,34 @@ async def send_message(
                     details=message_details
                 )
                 db.add(communication)
-                db.commit()
 
                 # Retrieve the user record to get details like name, brokerage, and phone number
-                user_record = db.query(User).get(data['user_id'])
+                user_record = await asyncio.to_thread(db.get, User, data['user_id'])
+                if user_record is None:
+                    logger.warning("send_message: user %s no longer exists", data['user_id'])
+                    return
+
+                # The record commits in a worker thread while the AI drafts the
+                # message; expire_on_commit=False keeps user_record readable
+                # without touching the session in the meantime. Both are waited
+                # for before any error is raised, so the rollback and close below
+                # never run while the commit is still using the session.
+                draft_via_ai = draft_sms_via_ai if data['message_type'].upper() == "SMS" else draft_email_message_via_ai
+                commit_result, drafted_message = await asyncio.gather(
+                    asyncio.to_thread(db.commit),
+                    draft_via_ai(user_record, lead, data['message_content']),
+                    return_exceptions=True
+                )
+                for result in (commit_result, drafted_message):
+                    if isinstance(result, BaseException):
+                        raise result
 
                 if data['message_type'].upper() == "SMS":
-                    # Generate a professional SMS message using AI with additional context
-                    sms_message = draft_sms_via_ai(user_record, lead, data['message_content'])
+                    sms_message = drafted_message
 
                     webhook_headers = {
                         "Content-Type": "application/json",
-                        "Authorization": f"Bearer {os.getenv('GHL_KEY')}"
+                        "Authorization": f"Bearer {get_settings().ghl_key}"
                     }
 
                     # Prepare payload for the SMS webhook request
@@ -1221,45 +1495,47 @@ async def send_message(
                         "message": sms_message
                     }
                     # Send the POST request to the SMS webhook
-                    sms_response = requests.post(sms_webhook_url, headers=webhook_headers,
-                                                 json=sms_payload)
-                    print("SMS webhook response:", sms_response.status_code, sms_response.text)
+                    sms_response = await get_http_client().post(
+                        sms_webhook_url, headers=webhook_headers, json=sms_payload
+                    )
+                    logger.info("SMS webhook response: %s %s", sms_response.status_code, sms_response.text)
 
                 elif data['message_type'].upper() == "EMAIL":
-                    # Generate a professional HTML email message using AI with additional context
-                    email_message = draft_email_message_via_ai(user_record, lead, data['message_content'])
+                    email_message = drafted_message
 
                     # Build email event details for the email-sending function
                     event_details = {
                         "summary": f"Message from {user_record.name}",
-                        "start_time": datetime.utcnow().isoformat(),
-                        "end_time": (datetime.utcnow() + timedelta(hours=1)).isoformat(),
+                        "start_time": sent_at.isoformat(),
+                        "end_time": (sent_at + timedelta(hours=1)).isoformat(),
                         "description": email_message,
                         "location": "",  # Not used for generic email messages
                         "html_link": ""
                     }
                     # Retrieve integration credentials for email sending (e.g., Gmail integration)
-                    credentials = get_user_credentials(data['user_id'])
+                    credentials = await asyncio.to_thread(get_user_credentials, data['user_id'])
                     sender_email = "noreply@example.com"
                     if credentials:
-                        credentials = refresh_and_save_credentials(data['user_id'], credentials)
-                        integration_record = db.query(Integration).filter_by(user_id=data['user_id'],
-                                                                             platform_name="google_calendar").first()
-                        if integration_record and integration_record.credentials.get("email"):
-                            sender_email = integration_record.credentials.get("email")
+                        credentials = await asyncio.to_thread(
+                            refresh_and_save_credentials, data['user_id'], credentials
+                        )
+                        stored_credentials = await asyncio.to_thread(get_user_credentials_dict, data['user_id'])
+                        if stored_credentials and stored_credentials.get("email"):
+                            sender_email = stored_credentials.get("email")
                     # Send the email using your email-sending function
-                    send_success = send_email_notification(credentials, sender_email, lead.email,
-                                                           event_details)
-                    print("Email sending status:", send_success)
+                    send_success = await send_email_notification_async(credentials, sender_email, lead.email,
+                                                                       event_details)
+                    logger.info("Email sending status: %s", send_success)
 
                 # Log that the message was processed
-                print(f"Message sent to {lead.name}: {data['message_content']} ({data['message_type'].upper()})")
+                logger.info("Message sent to %s (%s)", lead.name, data['message_type'].upper())
             except Exception as e:
-                db.rollback()
-                print(f"Error in background message process: {str(e)}")
+                await asyncio.to_thread(db.rollback)
+                logger.exception("Error in background message process: %s", e)
+            finally:
+                await asyncio.to_thread(db.close)
 
-        # Add background task (using a new SessionLocal instance)
-        background_tasks.add_task(background_message_process, SessionLocal())
+        background_tasks.add_task(background_message_process)
 
         # Prepare immediate response
         response_message = f"Message sending initiated to {lead.name}."
@@ -1289,7 +1565,7 @@ async def send_message(
         )
 
     except Exception as e:
-        print(f"Error in send_message endpoint: {str(e)}")
+        logger.exception("Error in send_message endpoint: %s", e)
         raise HTTPException(
             status_code=500,
             detail={
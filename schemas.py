@@ -0,0 +1,38 @@
+# schemas.py
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict, Field, constr
+
+
+class BookAppointmentRequest(BaseModel):
+    user_id: int
+    lead_name: constr(strip_whitespace=True, min_length=1)
+    start_time: datetime
+    description: Optional[str] = None
+    location: Optional[str] = None
+    meeting_type: str = "follow-up"
+
+
+class LeadMatch(BaseModel):
+    """A candidate lead listed when a name matches more than one lead."""
+    model_config = ConfigDict(from_attributes=True)
+
+    lead_id: int = Field(validation_alias='id')
+    name: Optional[str]
+    email: Optional[str]
+    phone: Optional[str]
+    status: Optional[str]
+    source: Optional[str]
+
+
+class ContactMatch(BaseModel):
+    """The same candidate, keyed the way initiate_call reports contacts."""
+    model_config = ConfigDict(from_attributes=True)
+
+    contact_id: int = Field(validation_alias='id')
+    name: Optional[str]
+    email: Optional[str]
+    phone: Optional[str]
+    status: Optional[str]
+    source: Optional[str]
@@ -0,0 +1,33 @@
+# task_queue.py
+import asyncio
+from typing import Optional
+
+from arq import create_pool
+from arq.connections import ArqRedis, RedisSettings
+
+from config import REDIS_URL
+
+REDIS_SETTINGS = RedisSettings.from_dsn(REDIS_URL)
+
+# Connection pool to the arq Redis queue, created on first use and closed on
+# app shutdown. Jobs are executed by worker.py, not by the API process.
+_pool: Optional[ArqRedis] = None
+# Threadpool handlers all enqueue on the app's event loop; the lock keeps
+# concurrent first calls from each opening a pool.
+_pool_lock = asyncio.Lock()
+
+
+async def enqueue_job(function, *args, **kwargs):
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await create_pool(REDIS_SETTINGS)
+    return await _pool.enqueue_job(function, *args, **kwargs)
+
+
+async def close_task_queue():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
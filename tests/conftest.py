@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules live at the repository root, not in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The OpenAI clients are created at import time and only need a key to exist.
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+import routes
+import worker
+
+
+class FakeQuery:
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def filter(self, *criteria):
+        return self
+
+    def all(self):
+        return self.jobs
+
+
+class FakeSession:
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.commits = 0
+        self.closed = False
+
+    def query(self, model):
+        return FakeQuery(self.jobs)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def _run_reaper(monkeypatch, jobs, batches):
+    session = FakeSession(jobs)
+    monkeypatch.setattr(routes, "SessionLocal", lambda: session)
+    monkeypatch.setattr(routes, "poll_batch", lambda batch_id: batches[batch_id])
+    routes.reap_bulk_draft_jobs()
+    return session
+
+
+def test_ended_batch_is_written_back(monkeypatch):
+    job = SimpleNamespace(batch_id="batch_1", status="submitted", results=None)
+    session = _run_reaper(monkeypatch, [job], {
+        "batch_1": ("completed", {"7": "Subject: Hi\n<p>Hello</p>", "8": None})
+    })
+
+    assert job.status == "completed"
+    assert job.results == {
+        "7": routes.clean_generated_email("Subject: Hi\n<p>Hello</p>"),
+        "8": None
+    }
+    assert session.commits == 1
+    assert session.closed
+
+
+def test_running_batch_keeps_waiting(monkeypatch):
+    job = SimpleNamespace(batch_id="batch_2", status="submitted", results=None)
+    _run_reaper(monkeypatch, [job], {"batch_2": ("in_progress", None)})
+
+    assert job.status == "in_progress"
+    assert job.results is None
+
+
+def test_reaper_is_scheduled_on_the_worker():
+    scheduled = [job.coroutine for job in worker.WorkerSettings.cron_jobs]
+    assert worker.reap_bulk_draft_jobs_job in scheduled
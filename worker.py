@@ -0,0 +1,189 @@
+# worker.py
+# Run with: arq worker.WorkerSettings
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import openai
+from arq import Retry, cron
+from googleapiclient.errors import HttpError
+from sqlalchemy import and_, select
+
+from database import SessionLocal
+from models import Integration, Lead, User
+from google_integration import (
+    build_service,
+    get_user_credentials,
+    refresh_and_save_credentials,
+    send_email_notification_async
+)
+from routes import draft_email_via_ai, reap_bulk_draft_jobs, render_invitation_template, render_meet_link
+from task_queue import REDIS_SETTINGS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+MAX_TRIES = 5
+RETRY_BASE_DELAY = 5  # seconds; doubled on every attempt
+RETRY_MAX_DELAY = 300
+
+# OpenAI errors that are worth retrying; anything else fails the job at once.
+RETRYABLE_OPENAI_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def _retry_delay(ctx):
+    return min(RETRY_BASE_DELAY * 2 ** (ctx['job_try'] - 1), RETRY_MAX_DELAY)
+
+
+def _is_retryable_google_error(error):
+    return error.resp.status == 429 or error.resp.status >= 500
+
+
+def _insert_meet_event(credentials, appointment_id, event_body):
+    """
+    Create the Meet event for an appointment. The event id is derived from
+    the appointment, so a retried job finds the event it already created
+    instead of inserting a duplicate.
+    """
+    service = build_service('calendar', 'v3', credentials)
+    event_id = f"appointment{appointment_id}"
+    try:
+        return service.events().insert(
+            calendarId='primary',
+            body={**event_body, 'id': event_id},
+            conferenceDataVersion=1
+        ).execute()
+    except HttpError as e:
+        if e.resp.status != 409:
+            raise
+        return service.events().get(calendarId='primary', eventId=event_id).execute()
+
+
+async def book_appointment_job(ctx, appointment_id, user_id, lead_id, start_time_iso, meeting_details,
+                               meeting_type, description, location):
+    """
+    Create the Google Meet event for an appointment recorded by /book_appointment
+    and email the lead an invitation, drafted by OpenAI for users with
+    use_ai_drafting and rendered from the template otherwise.
+
+    Rate limits and server errors from OpenAI or Google are retried with
+    exponential backoff, up to MAX_TRIES attempts.
+    """
+    start_time = datetime.fromisoformat(start_time_iso)
+    end_time = start_time + timedelta(hours=1)
+    db = SessionLocal()
+    try:
+        # 1. Load the lead, the user (for brokerage details) and the Google
+        # integration in one round trip.
+        row = await asyncio.to_thread(lambda: db.execute(
+            select(Lead, User, Integration)
+            .join(User, User.id == Lead.user_id)
+            .outerjoin(Integration, and_(
+                Integration.user_id == User.id,
+                Integration.platform_name == 'google_calendar'
+            ))
+            .where(Lead.id == lead_id, Lead.user_id == user_id)
+        ).first())
+        if row is None:
+            logger.warning("book_appointment_job: lead %s of user %s no longer exists", lead_id, user_id)
+            return
+        lead, user, integration = row
+
+        credentials = get_user_credentials(user_id, integration=integration) if integration else None
+        if not credentials:
+            logger.warning("book_appointment_job: no Google integration for user %s", user_id)
+            return
+        credentials = await asyncio.to_thread(refresh_and_save_credentials, user_id, credentials)
+
+        # 2. Create the calendar event.
+        event_body = {
+            'summary': f"Meeting with {lead.name}",
+            'description': meeting_details["notes"],
+            'start': {'dateTime': start_time.isoformat(), 'timeZone': 'UTC'},
+            'end': {'dateTime': end_time.isoformat(), 'timeZone': 'UTC'},
+            'conferenceData': {
+                'createRequest': {
+                    'requestId': f"appointment-{appointment_id}",
+                    'conferenceSolutionKey': {'type': 'hangoutsMeet'}
+                }
+            }
+        }
+
+        insert_event = asyncio.to_thread(_insert_meet_event, credentials, appointment_id, event_body)
+        if user.use_ai_drafting:
+            # 3. Have OpenAI draft the invitation while the event is being
+            # created; the Meet link is appended once the event exists.
+            event, drafted_email = await asyncio.gather(
+                insert_event,
+                draft_email_via_ai(
+                    user=user,
+                    meeting_type=meeting_type,
+                    meeting_details=dict(meeting_details),
+                    meeting_time=start_time,
+                    additional_description=description
+                )
+            )
+            meeting_details["meeting_link"] = event.get("hangoutLink")
+            drafted_email["body"] += render_meet_link(meeting_details["meeting_link"])
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Drafted email from OpenAI: %s", drafted_email)
+        else:
+            # 3. Render the invitation from the template, including the Meet link.
+            event = await insert_event
+            meeting_details["meeting_link"] = event.get("hangoutLink")
+            drafted_email = render_invitation_template(
+                user, meeting_type, start_time, meeting_details, description
+            )
+        logger.info("Created Google Meet event with link: %s", meeting_details["meeting_link"])
+
+        # 4. Build event details for the email notification.
+        event_details = {
+            "summary": f"Meeting with {lead.name}",
+            "start_time": start_time.isoformat(),
+            "end_time": end_time.isoformat(),
+            # Use the drafted email body.
+            "description": drafted_email.get("body", meeting_details["notes"]),
+            "location": location or 'Google Meet',
+            "html_link": meeting_details.get("meeting_link", "")
+        }
+
+        # 5. Determine the sender email from the integration credentials.
+        sender_email = integration.credentials.get('email') or 'noreply@example.com'
+
+        # 6. Send the drafted email via the Gmail API.
+        send_success = await send_email_notification_async(
+            credentials=credentials,
+            sender_email=sender_email,
+            recipient_email=lead.email,
+            event_details=event_details
+        )
+        if send_success:
+            logger.info("Email notification sent successfully.")
+        else:
+            logger.warning("Failed to send email notification.")
+    except RETRYABLE_OPENAI_ERRORS as e:
+        logger.warning("book_appointment_job: OpenAI error, retrying: %s", e)
+        raise Retry(defer=_retry_delay(ctx))
+    except HttpError as e:
+        if not _is_retryable_google_error(e):
+            raise
+        logger.warning("book_appointment_job: Google API error, retrying: %s", e)
+        raise Retry(defer=_retry_delay(ctx))
+    finally:
+        await asyncio.to_thread(db.close)
+
+
+async def reap_bulk_draft_jobs_job(ctx):
+    """
+    Store the drafts of OpenAI batches that finished since the last run; see
+    reap_bulk_draft_jobs in routes.py.
+    """
+    await asyncio.to_thread(reap_bulk_draft_jobs)
+
+
+class WorkerSettings:
+    functions = [book_appointment_job]
+    # Batches take minutes to hours, so checking every five minutes is plenty.
+    cron_jobs = [cron(reap_bulk_draft_jobs_job, minute=set(range(0, 60, 5)))]
+    redis_settings = REDIS_SETTINGS
+    max_tries = MAX_TRIES